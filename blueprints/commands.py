@@ -1,12 +1,15 @@
 import enum
+import asyncpg
 import router
 
-from typing import List
+from fastapi import Request, Response
+from typing import List, Optional
 
 from server import Backend
-from utils.responders import StandardResponse
+from utils.aliases import ALIAS_TABLES
+from utils.responders import StandardResponse, etag_matches, not_modified
 
-from pydantic import BaseModel, constr, validator
+from pydantic import BaseModel, conlist, constr, validator
 
 
 VarChar32 = constr(min_length=1, max_length=32, strip_whitespace=True)
@@ -34,6 +37,15 @@ class CommandsResponse(StandardResponse):
     data: List[Command]
 
 
+class ResolvedCommand(BaseModel):
+    source: str
+    command: Command
+
+
+class ResolvedCommandResponse(StandardResponse):
+    data: ResolvedCommand
+
+
 class CommandsBlueprint(router.Blueprint):
     __base_route__ = "/commands"
 
@@ -45,14 +57,98 @@ class CommandsBlueprint(router.Blueprint):
         endpoint_name="Get All Commands",
         methods=["GET"],
         response_model=CommandsResponse,
-        tags=["Commands"]
+        tags=["Commands"],
+        cache_control="public, max-age=30",
     )
-    async def list_commands(self):
-        results = await self.app.pool.fetch("""
-            SELECT * FROM bot_commands;
-        """)
+    async def list_commands(self, request: Request):
+        snapshot = self.app.commands.snapshot
+        if etag_matches(request, snapshot.etag):
+            return not_modified(snapshot.etag)
+
+        return Response(
+            content=snapshot.body,
+            media_type="application/json",
+            headers={"ETag": snapshot.etag},
+        )
+
+    @router.endpoint(
+        "/list/{category:str}",
+        endpoint_name="Get Commands In Category",
+        methods=["GET"],
+        response_model=CommandsResponse,
+        responses={
+            404: {
+                "model": StandardResponse
+            }
+        },
+        tags=["Commands"],
+        cache_control="public, max-age=30",
+    )
+    async def list_commands_in_category(self, category: str, request: Request):
+        snapshot = self.app.commands.snapshot
+        body = snapshot.categories.get(category)
+        if body is None:
+            return StandardResponse(
+                status=404,
+                data=f"no commands found in category {category!r}",
+            ).into_response()
+
+        if etag_matches(request, snapshot.etag):
+            return not_modified(snapshot.etag)
+
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"ETag": snapshot.etag},
+        )
+
+    @router.endpoint(
+        "/resolve",
+        endpoint_name="Resolve Command",
+        methods=["GET"],
+        response_model=ResolvedCommandResponse,
+        responses={
+            404: {
+                "model": StandardResponse
+            }
+        },
+        tags=["Commands"],
+    )
+    async def resolve_command(
+        self,
+        alias: VarChar32,
+        user_id: Optional[int] = None,
+        guild_id: Optional[int] = None,
+    ):
+        """
+        Gets the command an invoked word means for the given user in the
+        given guild. The user's aliases are checked first, then the guild's,
+        then command ids and names. ``source`` says which one matched.
+        """
+
+        snapshot = self.app.commands.snapshot
+        resolved = await self.app.aliases.resolve(
+            self.app.pool,
+            alias,
+            snapshot.by_id,
+            user_id=user_id,
+            guild_id=guild_id,
+        )
+
+        if resolved is not None:
+            command_id, source = resolved
+            command = snapshot.by_id[command_id]
+        else:
+            source = "command"
+            command = snapshot.by_id.get(alias) or snapshot.by_name.get(alias)
+
+        if command is None:
+            return StandardResponse(
+                status=404,
+                data=f"no command found for alias {alias!r}",
+            ).into_response()
 
-        return CommandsResponse(status=200, data=list(map(dict, results)))  # noqa
+        return ResolvedCommandResponse(status=200, data={"source": source, "command": command})  # noqa
 
     @router.endpoint(
         "/edit",
@@ -81,6 +177,7 @@ class CommandsBlueprint(router.Blueprint):
             payload.running, payload.user_required_permissions,
             payload.bot_required_permissions,
         )
+        await self.app.commands.refresh(self.app.pool)
 
         return StandardResponse(
             status=200,
@@ -100,6 +197,7 @@ class CommandsBlueprint(router.Blueprint):
         await self.app.pool.execute("""
             DELETE FROM bot_commands WHERE command_id = $1;
         """, command_id)
+        await self.app.commands.refresh(self.app.pool)
 
         return StandardResponse(
             status=200,
@@ -132,6 +230,136 @@ class AliasCopyTarget(enum.Enum):
     user = "user"
 
 
+class AliasOperationKind(enum.Enum):
+    add = "add"
+    remove = "remove"
+
+
+class AliasOperation(BaseModel):
+    op: AliasOperationKind
+    alias: VarChar32
+
+    # Optional for removes, which then drop the alias from every command.
+    command_id: VarChar32 = None
+
+    @validator("command_id")
+    def convert_id(cls, val: str):
+        return val.lower().replace(" ", "-")
+
+
+class AliasBulkEdit(BaseModel):
+    operations: conlist(AliasOperation, min_items=1, max_items=500)
+    atomic: bool = True
+
+
+class AliasOperationResult(BaseModel):
+    op: AliasOperationKind
+    alias: str
+    command_id: Optional[str]
+    status: str
+
+
+class AliasBulkEditResponse(StandardResponse):
+    data: List[AliasOperationResult]
+
+
+class UnknownCommands(Exception):
+    """ Raised inside the transaction to roll back an atomic alias edit. """
+
+
+async def write_alias_edits(conn, table: str, column: str, owner_id: int, adds: list, removes: list, atomic: bool):
+    """
+    Runs the removes then the adds of a bulk alias edit, adds naming a
+    command that doesn't exist are skipped and returned as unknown, or
+    raise ``UnknownCommands`` with them when ``atomic`` is set.
+    """
+    # Locked before the delete, whose changelog trigger takes the changelog
+    # advisory lock, in the same order removing a command takes them.
+    rows = await conn.fetch("""
+        SELECT command_id FROM bot_commands
+        WHERE command_id = any($1::text[])
+        FOR SHARE;
+    """, list({item.command_id for item in adds if item.command_id is not None}))
+    existing = {row['command_id'] for row in rows}
+
+    unknown = {
+        (item.command_id, item.alias)
+        for item in adds
+        if item.command_id not in existing
+    }
+    if unknown and atomic:
+        raise UnknownCommands(unknown)
+
+    removed = await conn.fetch(f"""
+        DELETE FROM {table}
+        USING unnest($2::text[], $3::text[]) AS r(command_id, alias)
+        WHERE 
+            {table}.{column} = $1
+            AND {table}.alias = r.alias
+            AND (r.command_id IS NULL OR {table}.command_id = r.command_id)
+        RETURNING {table}.command_id, {table}.alias;
+    """, owner_id, [item.command_id for item in removes], [item.alias for item in removes])
+
+    adds = [item for item in adds if (item.command_id, item.alias) not in unknown]
+    added = await conn.fetch(f"""
+        INSERT INTO {table} ({column}, command_id, alias)
+        SELECT $1, r.command_id, r.alias
+        FROM unnest($2::text[], $3::text[]) AS r(command_id, alias)
+        ON CONFLICT ({column}, command_id, alias)
+        DO NOTHING
+        RETURNING command_id, alias;
+    """, owner_id, [item.command_id for item in adds], [item.alias for item in adds])
+
+    return removed, added, unknown
+
+
+async def apply_alias_edits(app: Backend, scope: str, owner_id: int, edit: AliasBulkEdit) -> StandardResponse:
+    """
+    Applies many alias adds and removes in one transaction, removes go
+    first. Adds are ``added``, ``exists`` or ``unknown_command`` and removes
+    are ``removed`` or ``not_found``. When ``atomic`` is set a single
+    unknown command stops the whole batch and everything else is reported
+    as ``not_applied``.
+    """
+    table, column = ALIAS_TABLES[scope]
+
+    adds = [item for item in edit.operations if item.op == AliasOperationKind.add]
+    removes = [item for item in edit.operations if item.op == AliasOperationKind.remove]
+
+    try:
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                removed, added, unknown = await write_alias_edits(
+                    conn, table, column, owner_id, adds, removes, edit.atomic,
+                )
+    except UnknownCommands as e:
+        results = [
+            {**item.dict(), "status": "unknown_command" if (item.command_id, item.alias) in e.args[0] else "not_applied"}
+            for item in edit.operations
+        ]
+        return AliasBulkEditResponse(status=422, data=results)  # noqa
+
+    app.aliases.invalidate(scope, owner_id)
+
+    removed_aliases = {row['alias'] for row in removed}
+    removed_pairs = {(row['command_id'], row['alias']) for row in removed}
+    added_pairs = {(row['command_id'], row['alias']) for row in added}
+
+    results = []
+    for item in edit.operations:
+        key = (item.command_id, item.alias)
+        if item.op == AliasOperationKind.remove:
+            hit = key in removed_pairs if item.command_id is not None else item.alias in removed_aliases
+            status = "removed" if hit else "not_found"
+        elif key in unknown:
+            status = "unknown_command"
+        else:
+            status = "added" if key in added_pairs else "exists"
+        results.append({**item.dict(), "status": status})
+
+    return AliasBulkEditResponse(status=200, data=results)  # noqa
+
+
 class CommandUserAliasesBlueprint(router.Blueprint):
     __base_route__ = "/commands/aliases/users"
 
@@ -188,6 +416,7 @@ class CommandUserAliasesBlueprint(router.Blueprint):
                 data=f"command with command id {payload.command_id} does not exist",
             ).into_response()
 
+        self.app.aliases.invalidate("user", user_id)
         return StandardResponse(
             status=200,
             data=f"alias added for command id {payload.command_id}",
@@ -220,6 +449,7 @@ class CommandUserAliasesBlueprint(router.Blueprint):
                 DELETE FROM user_command_aliases
                 WHERE user_id = $1 AND command_id = $2;
             """, user_id, command_id)
+            self.app.aliases.invalidate("user", user_id)
             return StandardResponse(
                 status=200,
                 data=f"removed all aliases for command: {command_id} if exists",
@@ -230,6 +460,7 @@ class CommandUserAliasesBlueprint(router.Blueprint):
                 DELETE FROM user_command_aliases
                 WHERE user_id = $1 AND alias = $2;
             """, user_id, alias)
+            self.app.aliases.invalidate("user", user_id)
             return StandardResponse(
                 status=200,
                 data=f"removed alias: {alias} if exists",
@@ -240,6 +471,32 @@ class CommandUserAliasesBlueprint(router.Blueprint):
             data="missing one query out of alias or command_id",
         ).into_response()
 
+    @router.endpoint(
+        "/{user_id:int}/bulk",
+        endpoint_name="Bulk Edit User Aliases",
+        methods=["POST"],
+        response_model=AliasBulkEditResponse,
+        responses={
+            422: {
+                "model": AliasBulkEditResponse,
+                "description": "An atomic batch referenced a command that does not exist."
+            }
+        },
+        tags=["Command User Aliases"]
+    )
+    async def bulk_edit_aliases(self, user_id: int, payload: AliasBulkEdit):
+        """
+        Adds and removes many aliases for the given user in one transaction
+        and reports the outcome of each operation. With ``atomic`` off the
+        operations that can be applied are, rather than none of them.
+        """
+        # todo auth
+
+        response = await apply_alias_edits(self.app, "user", user_id, payload)
+        if response.status != 200:
+            return response.into_response()
+        return response
+
     @router.endpoint(
         "/{user_id:int}/copy",
         endpoint_name="Copy User Aliases",
@@ -275,6 +532,7 @@ class CommandUserAliasesBlueprint(router.Blueprint):
                 RETURNING alias, command_id;         
             """, user_id, copy_to)
 
+        self.app.aliases.invalidate(target.value, copy_to)
         return AliasCopyResponse(
             status=200,
             data=list(map(dict, results))
@@ -339,6 +597,7 @@ class CommandGuildAliasesBlueprint(router.Blueprint):
                 data=f"command with command id {payload.command_id} does not exist",
             ).into_response()
 
+        self.app.aliases.invalidate("guild", guild_id)
         return StandardResponse(
             status=200,
             data=f"alias added for command id {payload.command_id}",
@@ -372,6 +631,7 @@ class CommandGuildAliasesBlueprint(router.Blueprint):
                 DELETE FROM guild_command_aliases
                 WHERE guild_id = $1 AND command_id = $2;
             """, guild_id, command_id)
+            self.app.aliases.invalidate("guild", guild_id)
             return StandardResponse(
                 status=200,
                 data=f"removed all aliases for command: {command_id} if exists",
@@ -382,6 +642,7 @@ class CommandGuildAliasesBlueprint(router.Blueprint):
                 DELETE FROM guild_command_aliases
                 WHERE guild_id = $1 AND alias = $2;
             """, guild_id, alias)
+            self.app.aliases.invalidate("guild", guild_id)
             return StandardResponse(
                 status=200,
                 data=f"removed alias: {alias} if exists",
@@ -392,6 +653,32 @@ class CommandGuildAliasesBlueprint(router.Blueprint):
             data="missing one query out of alias or command_id",
         ).into_response()
 
+    @router.endpoint(
+        "/{guild_id:int}/bulk",
+        endpoint_name="Bulk Edit Guild Aliases",
+        methods=["POST"],
+        response_model=AliasBulkEditResponse,
+        responses={
+            422: {
+                "model": AliasBulkEditResponse,
+                "description": "An atomic batch referenced a command that does not exist."
+            }
+        },
+        tags=["Command Guild Aliases"]
+    )
+    async def bulk_edit_aliases(self, guild_id: int, payload: AliasBulkEdit):
+        """
+        Adds and removes many aliases for the given guild in one transaction
+        and reports the outcome of each operation. With ``atomic`` off the
+        operations that can be applied are, rather than none of them.
+        """
+        # todo auth
+
+        response = await apply_alias_edits(self.app, "guild", guild_id, payload)
+        if response.status != 200:
+            return response.into_response()
+        return response
+
     @router.endpoint(
         "/{guild_id:int}/copy",
         endpoint_name="Copy Guild Aliases",
@@ -428,6 +715,7 @@ class CommandGuildAliasesBlueprint(router.Blueprint):
                 RETURNING alias;         
             """, guild_id, copy_to)
 
+        self.app.aliases.invalidate(target.value, copy_to)
         return AliasCopyResponse(
             status=200,
             data=list(map(dict, results))
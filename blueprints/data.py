@@ -1,16 +1,29 @@
+import enum
+import zlib
+import logging
+import string
 import asyncio
-from functools import reduce
-from operator import or_
+import secrets
+from datetime import datetime
+from functools import partial
 
 import asyncpg
+import orjson
 import router
 
-from fastapi import Query
-from pydantic import BaseModel, validator, conint
-from typing import List, Optional
+from fastapi import Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError, validator, conint, conlist, parse_obj_as
+from typing import AsyncIterator, Dict, List, Optional
 
-from server import Backend
-from utils.responders import StandardResponse
+from server import Backend, SearchUnavailable, SEARCH_INDEX_TABLES
+from utils import settings, BatchLoader
+from utils.responders import StandardResponse, etag_matches, not_modified
+
+logger = logging.getLogger("crunchy.search")
+
+# Genre flags are stored as a BIGINT, anything wider can't be a valid filter.
+GenreFlags = conint(ge=-2**63, le=2**63 - 1)
 
 
 class PayloadData(BaseModel):
@@ -30,6 +43,160 @@ class PayloadData(BaseModel):
         return round(v, 1)
 
 
+INGEST_COLUMNS = {
+    "anime": [
+        "id",
+        "title",
+        "title_english",
+        "title_japanese",
+        "description",
+        "rating",
+        "img_url",
+        "link",
+        "genres",
+        "crunchyroll",
+    ],
+    "manga": [
+        "id",
+        "title",
+        "description",
+        "rating",
+        "img_url",
+        "link",
+        "genres",
+    ],
+}
+
+INGEST_COLUMN_TYPES = {
+    "id": "TEXT",
+    "title": "TEXT",
+    "title_english": "TEXT",
+    "title_japanese": "TEXT",
+    "description": "TEXT",
+    "rating": "FLOAT",
+    "img_url": "TEXT",
+    "link": "TEXT",
+    "genres": "BIGINT",
+    "crunchyroll": "BOOLEAN",
+}
+
+ID_CHARS = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+
+def random_id(length: int = 18) -> str:
+    """ Matches the ids made by the random_string() postgres function. """
+    return "".join(secrets.choice(ID_CHARS) for _ in range(length))
+
+
+class IngestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+async def read_ingest_payload(request: Request) -> List[PayloadData]:
+    """
+    Reads a bulk ingest body, either a JSON array of payloads or NDJSON
+    with one payload per line when sent as ``application/x-ndjson``.
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            items = []
+            buffer = b""
+            async for chunk in request.stream():
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                items.extend(orjson.loads(line) for line in lines if line.strip())
+
+                if len(items) > settings.BULK_INGEST_MAX_ITEMS:
+                    raise IngestError(413, f"at most {settings.BULK_INGEST_MAX_ITEMS} items can be ingested at once")
+
+            if buffer.strip():
+                items.append(orjson.loads(buffer))
+        else:
+            items = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise IngestError(422, f"invalid json: {e}")
+
+    if not isinstance(items, list):
+        raise IngestError(422, "expected a json array of items")
+
+    if len(items) > settings.BULK_INGEST_MAX_ITEMS:
+        raise IngestError(413, f"at most {settings.BULK_INGEST_MAX_ITEMS} items can be ingested at once")
+
+    try:
+        return parse_obj_as(List[PayloadData], items)
+    except ValidationError as e:
+        raise IngestError(422, str(e))
+
+
+async def bulk_ingest(app: Backend, index: str, payloads: List[PayloadData]) -> List[dict]:
+    """
+    Upserts many catalog rows at once, rows are copied into a temporary
+    staging table and merged into the catalog with a single statement.
+    """
+    columns = INGEST_COLUMNS[index]
+    table = SEARCH_INDEX_TABLES[index]
+
+    # Later items win when a title is repeated, the upsert can only touch a row once.
+    by_title = {payload.title: payload for payload in payloads}
+    records = [
+        tuple(random_id() if column == "id" else getattr(payload, column) for column in columns)
+        for payload in by_title.values()
+    ]
+
+    staging = f"ingest_{index}"
+    updates = ",\n".join(
+        f"{column} = excluded.{column}"
+        for column in columns
+        if column not in ("id", "title")
+    )
+    async with app.pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"""
+                CREATE TEMP TABLE {staging} (
+                    {", ".join(f"{column} {INGEST_COLUMN_TYPES[column]}" for column in columns)}
+                ) ON COMMIT DROP;
+            """)
+            await conn.copy_records_to_table(staging, records=records, columns=columns)
+            rows = await conn.fetch(f"""
+                INSERT INTO {table} ({", ".join(columns)})
+                SELECT {", ".join(columns)} FROM {staging}
+                ON CONFLICT (title)
+                DO UPDATE SET
+                    {updates}
+                RETURNING {", ".join(columns)};
+            """)
+
+    rows = [dict(row) for row in rows]
+    snapshot = app.catalog[index]
+    row_cache = app.catalog.row_cache[index]
+    names = app.genres.decode_many(row['genres'] for row in rows)
+    for row, genres in zip(rows, names):
+        snapshot.upsert(row['id'], row['title'], row['rating'], row['genres'])
+        row_cache.invalidate(row['id'])
+        row['genres'] = genres
+
+    app.meili.push_documents(index, rows)
+
+    # A bulk load can reshuffle the top of the catalog, don't wait for the schedule.
+    if app.catalog.ready:
+        app.catalog.rank(app, index)
+
+    ids = {row['title']: row['id'] for row in rows}
+    return [{"title": title, "id": ids[title]} for title in by_title]
+
+
+class IngestedItem(BaseModel):
+    title: str
+    id: str
+
+
+class IngestResponse(StandardResponse):
+    data: List[IngestedItem]
+
+
 class ResultPayloadData(PayloadData):
     genres: List[str] = []
 
@@ -38,6 +205,145 @@ class DataResponse(StandardResponse):
     data: ResultPayloadData
 
 
+CATALOG_ROW_QUERIES = {
+    "anime": """
+        SELECT 
+            id,
+            title,
+            title_english,
+            title_japanese, 
+            description, 
+            rating, 
+            img_url, 
+            link, 
+            genres,
+            crunchyroll,
+            xmin::text AS version
+        FROM api_anime_data
+    """,
+    "manga": """
+        SELECT 
+            id,
+            title, 
+            description, 
+            rating, 
+            img_url, 
+            link, 
+            genres,
+            xmin::text AS version
+        FROM api_manga_data
+    """,
+}
+
+
+class BatchResults(BaseModel):
+    items: List[Optional[ResultPayloadData]]
+    missing: List[str]
+
+
+class BatchResponse(StandardResponse):
+    data: BatchResults
+
+
+async def fetch_catalog_rows(app: Backend, index: str, ids: List[str]) -> Dict[str, dict]:
+    """ Fetches many catalog rows in one query, keyed by id with genres named. """
+
+    rows = await app.pool.fetch(f"""
+        {CATALOG_ROW_QUERIES[index]}
+        WHERE id = any($1::text[]);
+    """, list(set(ids)))
+
+    rows = [dict(row) for row in rows]
+    names = app.genres.decode_many(row['genres'] for row in rows)
+    for row, genres in zip(rows, names):
+        row['genres'] = genres
+
+    return {row['id']: row for row in rows}
+
+
+def row_etag(app: Backend, row: dict) -> str:
+    """ A row's xmin changes on every write, the genre digest covers renamed genres. """
+    return f'"{row["id"]}-{row["version"]}-{app.genres.digest}"'
+
+
+async def batch_get(app: Backend, index: str, ids: List[str]) -> dict:
+    found = await fetch_catalog_rows(app, index, ids)
+    return {
+        "items": [found.get(doc_id) for doc_id in ids],
+        "missing": [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in found],
+    }
+
+
+class ListResults(BaseModel):
+    items: List[ResultPayloadData]
+    next: Optional[str]
+
+
+class ListResponse(StandardResponse):
+    data: ListResults
+
+
+async def list_catalog(app: Backend, index: str, after: Optional[str], limit: int) -> dict:
+    """
+    Gets a page of rows ordered by id starting after the given id, ``next``
+    is the cursor for the following page or None on the last one.
+    """
+
+    # One extra row tells us whether another page exists.
+    rows = await app.pool.fetch(f"""
+        {CATALOG_ROW_QUERIES[index]}
+        WHERE $1::text IS NULL OR id > $1::text
+        ORDER BY id
+        LIMIT $2;
+    """, after, limit + 1)
+
+    has_more = len(rows) > limit
+    rows = [dict(row) for row in rows[:limit]]
+    names = app.genres.decode_many(row['genres'] for row in rows)
+    for row, genres in zip(rows, names):
+        row['genres'] = genres
+
+    return {
+        "items": rows,
+        "next": rows[-1]['id'] if has_more else None,
+    }
+
+
+async def export_catalog(app: Backend, index: str, compress: bool) -> AsyncIterator[bytes]:
+    """
+    Streams every row of a catalog table as NDJSON, optionally gzipped.
+    Rows come off a server side cursor a batch at a time so memory stays
+    flat however big the table is.
+    """
+
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    async with app.pool.acquire() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(CATALOG_ROW_QUERIES[index])
+            while True:
+                rows = await cursor.fetch(settings.CATALOG_EXPORT_BATCH_SIZE)
+                if len(rows) == 0:
+                    break
+
+                lines = []
+                for row in rows:
+                    row = dict(row)
+                    del row['version']
+                    row['genres'] = app.genres.decode(row['genres'])
+                    lines.append(orjson.dumps(row))
+                lines.append(b"")
+                chunk = b"\n".join(lines)
+
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
+
+
 class SearchResults(BaseModel):
     hits: List[dict]
     offset: int
@@ -49,35 +355,426 @@ class SearchResponse(StandardResponse):
     data: SearchResults
 
 
+class SearchIndex(enum.Enum):
+    anime = "anime"
+    manga = "manga"
+
+
+class SearchSort(enum.Enum):
+    rating_desc = "rating:desc"
+    rating_asc = "rating:asc"
+
+
+class MultiSearchQuery(BaseModel):
+    query: str
+    index: Optional[SearchIndex] = None
+    offset: conint(ge=0) = 0
+    limit: conint(gt=0, le=50) = 10
+    genres: GenreFlags = 0
+    min_rating: Optional[float] = None
+    sort: Optional[SearchSort] = None
+
+
+class MultiSearchResult(BaseModel):
+    index: SearchIndex
+    results: Optional[SearchResults] = None
+    error: Optional[str] = None
+
+
+class MultiSearchResponse(StandardResponse):
+    data: List[MultiSearchResult]
+
+
+def search_options(
+    app: Backend,
+    offset: int,
+    limit: int,
+    genres: int = 0,
+    min_rating: Optional[float] = None,
+    sort: Optional[SearchSort] = None,
+) -> dict:
+    """
+    Builds the options passed to ``MeiliEngine.search``, ``genres`` uses
+    the same bit flags as the genre endpoints and every flagged genre must
+    be present on a hit.
+    """
+    return {
+        'offset': offset,
+        'limit': limit,
+        'genres': app.genres.decode(genres),
+        'min_rating': min_rating,
+        'sort': sort.value if sort is not None else None,
+    }
+
+
+async def multi_search(
+    app: Backend,
+    default_index: SearchIndex,
+    queries: List[MultiSearchQuery],
+) -> List[dict]:
+    async def run(qry: MultiSearchQuery) -> dict:
+        index = qry.index or default_index
+        if app.genres.unknown_flags(qry.genres):
+            return {"index": index, "error": "genres contains flags that match no genre"}
+
+        try:
+            options = search_options(
+                app,
+                qry.offset,
+                qry.limit,
+                qry.genres,
+                qry.min_rating,
+                qry.sort,
+            )
+            results = await asyncio.wait_for(
+                app.meili.search(index.value, qry.query, options),
+                timeout=settings.SEARCH_MULTI_QUERY_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            return {"index": index, "error": "search timed out"}
+        except SearchUnavailable:
+            return {"index": index, "error": "search is temporarily unavailable"}
+        except Exception:
+            logger.exception("multi search query against %s failed", index.value)
+            return {"index": index, "error": "search failed"}
+
+        return {"index": index, "results": dict(results)}
+
+    return await asyncio.gather(*map(run, queries))
+
+
+class AutocompleteHit(BaseModel):
+    id: str
+    title: str
+    title_english: Optional[str]
+    title_japanese: Optional[str]
+
+
+class AutocompleteResponse(StandardResponse):
+    data: List[AutocompleteHit]
+
+
+class BrowseHit(BaseModel):
+    id: str
+    title: str
+    rating: float
+    genres: List[str]
+
+
+class BrowseResults(BaseModel):
+    hits: List[BrowseHit]
+    total: int
+    offset: int
+    limit: int
+
+
+class BrowseResponse(StandardResponse):
+    data: BrowseResults
+
+
+class SimilarHit(BrowseHit):
+    score: float
+
+
+class SimilarResponse(StandardResponse):
+    data: List[SimilarHit]
+
+
+def with_genre_names(app: Backend, hits: List[dict]) -> List[dict]:
+    """ Copies snapshot rows with their genre flags decoded to names. """
+
+    names = app.genres.decode_many(hit['genres'] for hit in hits)
+    return [{**hit, 'genres': genres} for hit, genres in zip(hits, names)]
+
+
+class RankedResponse(StandardResponse):
+    data: List[BrowseHit]
+
+
+def ranked_list(app: Backend, index: str, genre: Optional[str] = None) -> Response:
+    bodies = app.catalog.rankings.get(index)
+    if bodies is None:
+        return StandardResponse(
+            status=503,
+            data="ranked lists are temporarily unavailable",
+        ).into_response()
+
+    genre_id = None
+    if genre is not None:
+        genre_id = app.genres.get_by_name(genre)
+        if genre_id is None or genre_id not in bodies:
+            return StandardResponse(
+                status=404,
+                data=f"genre does not exist with name {genre!r}",
+            ).into_response()
+
+    return Response(content=bodies[genre_id], media_type="application/json")
+
+
+def browse_catalog(app: Backend, index: str, offset: int, limit: int, **filters) -> Optional[dict]:
+    if not app.catalog.ready:
+        return None
+
+    total, hits = app.catalog[index].browse(offset, limit, **filters)
+    return {
+        "hits": with_genre_names(app, hits),
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+    }
+
+
 class AnimeEndpoints(router.Blueprint):
     __base_route__ = "/data/anime"
 
     def __init__(self, app: Backend):
         self.app = app
+        self.loader = BatchLoader(
+            partial(fetch_catalog_rows, app, "anime"),
+            max_batch=settings.CATALOG_LOADER_MAX_BATCH,
+            max_wait=settings.CATALOG_LOADER_MAX_WAIT,
+        )
 
     @router.endpoint(
         "/search",
         endpoint_name="Search Anime",
         methods=["GET"],
         response_model=SearchResponse,
+        responses={
+            422: {
+                "model": StandardResponse,
+                "description": "The genres flags contain a bit that matches no genre."
+            },
+            503: {
+                "model": StandardResponse,
+                "description": "Meili is down and the fallback engine is still loading."
+            }
+        },
         tags=["Anime"]
     )
-    def search_anime(
+    async def search_anime(
         self,
         query: str,
         offset: conint(ge=0) = 0,
         limit: conint(gt=0, le=50) = 10,
+        genres: GenreFlags = 0,
+        min_rating: Optional[float] = None,
+        sort: Optional[SearchSort] = None,
     ):
-        results = self.app.meili.anime.search(
-            query,
-            {
-                'offset': offset,
-                'limit': limit,
-            },
-        )
+        """
+        Searches the anime catalog, results can be narrowed to titles having
+        every genre in the ``genres`` flags and a rating of at least
+        ``min_rating``, and ordered by rating with ``sort``.
+        """
+
+        if self.app.genres.unknown_flags(genres):
+            return StandardResponse(
+                status=422,
+                data="genres contains flags that match no genre",
+            ).into_response()
+
+        options = search_options(self.app, offset, limit, genres, min_rating, sort)
+        try:
+            results = await self.app.meili.search("anime", query, options)
+        except SearchUnavailable:
+            return StandardResponse(
+                status=503,
+                data="search is temporarily unavailable",
+            ).into_response()
 
         return SearchResponse(status=200, data=dict(results))  # noqa
 
+    @router.endpoint(
+        "/search/multi",
+        endpoint_name="Multi Search Anime",
+        methods=["POST"],
+        response_model=MultiSearchResponse,
+        tags=["Anime"]
+    )
+    async def multi_search_anime(self, queries: conlist(MultiSearchQuery, min_items=1, max_items=25)):
+        """
+        Runs several searches concurrently and returns their results in the
+        order given, each query defaults to the anime index. A query which
+        fails or times out is reported on its own without holding up the rest.
+        """
+
+        results = await multi_search(self.app, SearchIndex.anime, queries)
+        return MultiSearchResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "/autocomplete",
+        endpoint_name="Autocomplete Anime",
+        methods=["GET"],
+        response_model=AutocompleteResponse,
+        responses={
+            503: {
+                "model": StandardResponse,
+                "description": "The autocomplete index is still loading."
+            }
+        },
+        tags=["Anime"]
+    )
+    async def autocomplete_anime(self, query: str, limit: conint(gt=0, le=25) = 10):
+        """ Completes a partial anime title, any word in a title can be the start. """
+
+        try:
+            hits = self.app.meili.complete("anime", query, limit)
+        except SearchUnavailable:
+            return StandardResponse(
+                status=503,
+                data="autocomplete is temporarily unavailable",
+            ).into_response()
+
+        return AutocompleteResponse(status=200, data=hits)  # noqa
+
+    @router.endpoint(
+        "/browse",
+        endpoint_name="Browse Anime",
+        methods=["GET"],
+        response_model=BrowseResponse,
+        responses={
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Anime"]
+    )
+    async def browse_anime(
+        self,
+        all_genres: GenreFlags = 0,
+        any_genres: GenreFlags = 0,
+        exclude_genres: GenreFlags = 0,
+        min_rating: Optional[float] = None,
+        max_rating: Optional[float] = None,
+        offset: conint(ge=0) = 0,
+        limit: conint(gt=0, le=100) = 25,
+    ):
+        """
+        Lists the top rated anime matching the given genre flags, titles must
+        have every genre in ``all_genres``, at least one in ``any_genres``
+        and none in ``exclude_genres``.
+        """
+
+        results = browse_catalog(
+            self.app,
+            "anime",
+            offset,
+            limit,
+            all_of=all_genres,
+            any_of=any_genres,
+            none_of=exclude_genres,
+            min_rating=min_rating,
+            max_rating=max_rating,
+        )
+        if results is None:
+            return StandardResponse(
+                status=503,
+                data="browsing is temporarily unavailable",
+            ).into_response()
+
+        return BrowseResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "/batch",
+        endpoint_name="Get Anime With Ids",
+        methods=["POST"],
+        response_model=BatchResponse,
+        tags=["Anime"]
+    )
+    async def get_anime_with_ids(self, ids: conlist(str, min_items=1, max_items=500)):
+        """
+        Gets many anime in one request. ``items`` follows the order of the
+        given ids with ``null`` in place of any id that doesn't exist, those
+        ids are also listed in ``missing``.
+        """
+
+        results = await batch_get(self.app, "anime", ids)
+        return BatchResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "",
+        endpoint_name="List Anime",
+        methods=["GET"],
+        response_model=ListResponse,
+        tags=["Anime"]
+    )
+    async def list_anime(self, after: Optional[str] = None, limit: conint(gt=0, le=500) = 100):
+        """
+        Lists every anime ordered by id. Pass the ``next`` value of a page as
+        ``after`` to get the one following it, ``next`` is null on the last page.
+        """
+
+        results = await list_catalog(self.app, "anime", after, limit)
+        return ListResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "/export",
+        endpoint_name="Export Anime",
+        methods=["GET"],
+        response_class=StreamingResponse,
+        responses={
+            200: {
+                "content": {"application/x-ndjson": {}, "application/gzip": {}},
+                "description": "Every anime as one JSON object per line."
+            }
+        },
+        tags=["Anime"]
+    )
+    async def export_anime(self, gzip: bool = False):
+        """
+        Streams the whole anime table as NDJSON, gzip compressed when ``gzip``
+        is set. Use this instead of paging through search for full dumps.
+        """
+
+        filename = "anime.ndjson.gz" if gzip else "anime.ndjson"
+        return StreamingResponse(
+            export_catalog(self.app, "anime", gzip),
+            media_type="application/gzip" if gzip else "application/x-ndjson",
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+
+    @router.endpoint(
+        "/top",
+        endpoint_name="Get Top Rated Anime",
+        methods=["GET"],
+        response_model=RankedResponse,
+        responses={
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Anime"],
+        cache_control="public, max-age=60",
+    )
+    async def get_top_anime(self):
+        """ Gets the highest rated anime, the list is rebuilt in the background. """
+
+        return ranked_list(self.app, "anime")
+
+    @router.endpoint(
+        "/top/{genre:str}",
+        endpoint_name="Get Top Rated Anime In Genre",
+        methods=["GET"],
+        response_model=RankedResponse,
+        responses={
+            404: {
+                "model": StandardResponse
+            },
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Anime"],
+        cache_control="public, max-age=60",
+    )
+    async def get_top_anime_in_genre(self, genre: str):
+        """ Gets the highest rated anime with the given genre name. """
+
+        return ranked_list(self.app, "anime", genre)
+
     @router.endpoint(
         "/{anime_id:str}",
         endpoint_name="Get Anime With Id",
@@ -88,24 +785,11 @@ class AnimeEndpoints(router.Blueprint):
                 "model": StandardResponse
             }
         },
-        tags=["Anime"]
+        tags=["Anime"],
+        cache_control="public, max-age=60",
     )
-    async def get_anime_with_id(self, anime_id: str):
-        row = await self.app.pool.fetchrow("""
-            SELECT 
-                id,
-                title,
-                title_english,
-                title_japanese, 
-                description, 
-                rating, 
-                img_url, 
-                link, 
-                array(SELECT name FROM api_genres WHERE id & api_anime_data.genres != 0) as genres,
-                crunchyroll
-            FROM api_anime_data
-            WHERE id = $1;
-            """, anime_id)
+    async def get_anime_with_id(self, anime_id: str, request: Request, response: Response):
+        row = await self.app.catalog.row_cache["anime"].get(anime_id, self.loader.load)
 
         if row is None:
             return StandardResponse(
@@ -113,7 +797,46 @@ class AnimeEndpoints(router.Blueprint):
                 data=f"no anime found with id: {anime_id!r}",
             ).into_response()
 
-        return DataResponse(status=200, data=dict(row))  # noqa
+        etag = row_etag(self.app, row)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response.headers["ETag"] = etag
+        return DataResponse(status=200, data=row)  # noqa
+
+    @router.endpoint(
+        "/{anime_id:str}/similar",
+        endpoint_name="Get Similar Anime",
+        methods=["GET"],
+        response_model=SimilarResponse,
+        responses={
+            404: {
+                "model": StandardResponse
+            },
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Anime"]
+    )
+    async def get_similar_anime(self, anime_id: str, limit: conint(gt=0, le=50) = 10):
+        """ Gets the anime sharing the most genres with the given one, favouring higher ratings. """
+
+        if not self.app.catalog.ready:
+            return StandardResponse(
+                status=503,
+                data="similar titles are temporarily unavailable",
+            ).into_response()
+
+        hits = self.app.catalog.similar("anime", anime_id, limit)
+        if hits is None:
+            return StandardResponse(
+                status=404,
+                data=f"no anime found with id: {anime_id!r}",
+            ).into_response()
+
+        return SimilarResponse(status=200, data=with_genre_names(self.app, hits))  # noqa
 
     @router.endpoint(
         "/",
@@ -170,16 +893,11 @@ class AnimeEndpoints(router.Blueprint):
             )
 
         row = dict(row)
-        g_rows = await self.app.pool.fetch("""
-        SELECT name FROM api_genres WHERE id & $1 != 0;
-        """, row['genres'])
-        row['genres'] = [g_row['name'] for g_row in g_rows]
-
-        asyncio.get_running_loop().run_in_executor(
-            None,
-            self.app.meili.anime.add_documents,
-            [row]
-        )
+        self.app.catalog["anime"].upsert(row['id'], row['title'], row['rating'], row['genres'])
+        self.app.catalog.row_cache["anime"].invalidate(row['id'])
+        row['genres'] = self.app.genres.decode(row['genres'])
+
+        await self.app.meili.queue_documents("anime", [row])
 
         return StandardResponse(
             status=200,
@@ -189,36 +907,290 @@ class AnimeEndpoints(router.Blueprint):
             }
         )
 
+    @router.endpoint(
+        "/bulk",
+        endpoint_name="Bulk Add Anime",
+        methods=["POST"],
+        response_model=IngestResponse,
+        responses={
+            413: {
+                "model": StandardResponse,
+                "description": "Too many items were sent in one request."
+            },
+            422: {
+                "model": StandardResponse,
+                "description": "The body is not valid json or an item is invalid."
+            }
+        },
+        tags=["Anime"]
+    )
+    async def bulk_add_anime(self, request: Request):
+        """
+        Adds or updates many anime at once. The body is a JSON array of the
+        same payloads ``POST /`` takes, or NDJSON with one payload per line
+        when sent as ``application/x-ndjson``. Returns the id of each title.
+        """
+
+        try:
+            payloads = await read_ingest_payload(request)
+        except IngestError as e:
+            return StandardResponse(status=e.status, data=e.message).into_response()
+
+        ids = await bulk_ingest(self.app, "anime", payloads)
+        return IngestResponse(status=200, data=ids)  # noqa
+
 
 class MangaEndpoints(router.Blueprint):
     __base_route__ = "/data/manga"
 
     def __init__(self, app: Backend):
         self.app = app
+        self.loader = BatchLoader(
+            partial(fetch_catalog_rows, app, "manga"),
+            max_batch=settings.CATALOG_LOADER_MAX_BATCH,
+            max_wait=settings.CATALOG_LOADER_MAX_WAIT,
+        )
 
     @router.endpoint(
         "/search",
         endpoint_name="Search Manga",
         methods=["GET"],
         response_model=SearchResponse,
+        responses={
+            422: {
+                "model": StandardResponse,
+                "description": "The genres flags contain a bit that matches no genre."
+            },
+            503: {
+                "model": StandardResponse,
+                "description": "Meili is down and the fallback engine is still loading."
+            }
+        },
         tags=["Manga"]
     )
-    def search_anime(
+    async def search_anime(
         self,
         query: str,
         offset: conint(ge=0) = 0,
         limit: conint(gt=0, le=50) = 10,
+        genres: GenreFlags = 0,
+        min_rating: Optional[float] = None,
+        sort: Optional[SearchSort] = None,
     ):
-        results = self.app.meili.manga.search(
-            query,
-            {
-                'offset': offset,
-                'limit': limit,
-            },
-        )
+        """
+        Searches the manga catalog, results can be narrowed to titles having
+        every genre in the ``genres`` flags and a rating of at least
+        ``min_rating``, and ordered by rating with ``sort``.
+        """
+
+        if self.app.genres.unknown_flags(genres):
+            return StandardResponse(
+                status=422,
+                data="genres contains flags that match no genre",
+            ).into_response()
+
+        options = search_options(self.app, offset, limit, genres, min_rating, sort)
+        try:
+            results = await self.app.meili.search("manga", query, options)
+        except SearchUnavailable:
+            return StandardResponse(
+                status=503,
+                data="search is temporarily unavailable",
+            ).into_response()
 
         return SearchResponse(status=200, data=dict(results))  # noqa
 
+    @router.endpoint(
+        "/search/multi",
+        endpoint_name="Multi Search Manga",
+        methods=["POST"],
+        response_model=MultiSearchResponse,
+        tags=["Manga"]
+    )
+    async def multi_search_manga(self, queries: conlist(MultiSearchQuery, min_items=1, max_items=25)):
+        """
+        Runs several searches concurrently and returns their results in the
+        order given, each query defaults to the manga index. A query which
+        fails or times out is reported on its own without holding up the rest.
+        """
+
+        results = await multi_search(self.app, SearchIndex.manga, queries)
+        return MultiSearchResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "/autocomplete",
+        endpoint_name="Autocomplete Manga",
+        methods=["GET"],
+        response_model=AutocompleteResponse,
+        responses={
+            503: {
+                "model": StandardResponse,
+                "description": "The autocomplete index is still loading."
+            }
+        },
+        tags=["Manga"]
+    )
+    async def autocomplete_manga(self, query: str, limit: conint(gt=0, le=25) = 10):
+        """ Completes a partial manga title, any word in a title can be the start. """
+
+        try:
+            hits = self.app.meili.complete("manga", query, limit)
+        except SearchUnavailable:
+            return StandardResponse(
+                status=503,
+                data="autocomplete is temporarily unavailable",
+            ).into_response()
+
+        return AutocompleteResponse(status=200, data=hits)  # noqa
+
+    @router.endpoint(
+        "/browse",
+        endpoint_name="Browse Manga",
+        methods=["GET"],
+        response_model=BrowseResponse,
+        responses={
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Manga"]
+    )
+    async def browse_manga(
+        self,
+        all_genres: GenreFlags = 0,
+        any_genres: GenreFlags = 0,
+        exclude_genres: GenreFlags = 0,
+        min_rating: Optional[float] = None,
+        max_rating: Optional[float] = None,
+        offset: conint(ge=0) = 0,
+        limit: conint(gt=0, le=100) = 25,
+    ):
+        """
+        Lists the top rated manga matching the given genre flags, titles must
+        have every genre in ``all_genres``, at least one in ``any_genres``
+        and none in ``exclude_genres``.
+        """
+
+        results = browse_catalog(
+            self.app,
+            "manga",
+            offset,
+            limit,
+            all_of=all_genres,
+            any_of=any_genres,
+            none_of=exclude_genres,
+            min_rating=min_rating,
+            max_rating=max_rating,
+        )
+        if results is None:
+            return StandardResponse(
+                status=503,
+                data="browsing is temporarily unavailable",
+            ).into_response()
+
+        return BrowseResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "/batch",
+        endpoint_name="Get Manga With Ids",
+        methods=["POST"],
+        response_model=BatchResponse,
+        tags=["Manga"]
+    )
+    async def get_manga_with_ids(self, ids: conlist(str, min_items=1, max_items=500)):
+        """
+        Gets many manga in one request. ``items`` follows the order of the
+        given ids with ``null`` in place of any id that doesn't exist, those
+        ids are also listed in ``missing``.
+        """
+
+        results = await batch_get(self.app, "manga", ids)
+        return BatchResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "",
+        endpoint_name="List Manga",
+        methods=["GET"],
+        response_model=ListResponse,
+        tags=["Manga"]
+    )
+    async def list_manga(self, after: Optional[str] = None, limit: conint(gt=0, le=500) = 100):
+        """
+        Lists every manga ordered by id. Pass the ``next`` value of a page as
+        ``after`` to get the one following it, ``next`` is null on the last page.
+        """
+
+        results = await list_catalog(self.app, "manga", after, limit)
+        return ListResponse(status=200, data=results)  # noqa
+
+    @router.endpoint(
+        "/export",
+        endpoint_name="Export Manga",
+        methods=["GET"],
+        response_class=StreamingResponse,
+        responses={
+            200: {
+                "content": {"application/x-ndjson": {}, "application/gzip": {}},
+                "description": "Every manga as one JSON object per line."
+            }
+        },
+        tags=["Manga"]
+    )
+    async def export_manga(self, gzip: bool = False):
+        """
+        Streams the whole manga table as NDJSON, gzip compressed when ``gzip``
+        is set. Use this instead of paging through search for full dumps.
+        """
+
+        filename = "manga.ndjson.gz" if gzip else "manga.ndjson"
+        return StreamingResponse(
+            export_catalog(self.app, "manga", gzip),
+            media_type="application/gzip" if gzip else "application/x-ndjson",
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+
+    @router.endpoint(
+        "/top",
+        endpoint_name="Get Top Rated Manga",
+        methods=["GET"],
+        response_model=RankedResponse,
+        responses={
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Manga"],
+        cache_control="public, max-age=60",
+    )
+    async def get_top_manga(self):
+        """ Gets the highest rated manga, the list is rebuilt in the background. """
+
+        return ranked_list(self.app, "manga")
+
+    @router.endpoint(
+        "/top/{genre:str}",
+        endpoint_name="Get Top Rated Manga In Genre",
+        methods=["GET"],
+        response_model=RankedResponse,
+        responses={
+            404: {
+                "model": StandardResponse
+            },
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Manga"],
+        cache_control="public, max-age=60",
+    )
+    async def get_top_manga_in_genre(self, genre: str):
+        """ Gets the highest rated manga with the given genre name. """
+
+        return ranked_list(self.app, "manga", genre)
+
     @router.endpoint(
         "/{manga_id:str}",
         endpoint_name="Get Manga With Id",
@@ -229,21 +1201,11 @@ class MangaEndpoints(router.Blueprint):
                 "model": StandardResponse
             }
         },
-        tags=["Manga"]
+        tags=["Manga"],
+        cache_control="public, max-age=60",
     )
-    async def get_manga_with_id(self, manga_id: str):
-        row = await self.app.pool.fetchrow("""
-            SELECT 
-                id,
-                title, 
-                description, 
-                rating, 
-                img_url, 
-                link, 
-                array(SELECT name FROM api_genres WHERE id & api_manga_data.genres != 0) as genres
-            FROM api_manga_data
-            WHERE id = $1;
-            """, manga_id)
+    async def get_manga_with_id(self, manga_id: str, request: Request, response: Response):
+        row = await self.app.catalog.row_cache["manga"].get(manga_id, self.loader.load)
 
         if row is None:
             return StandardResponse(
@@ -251,7 +1213,78 @@ class MangaEndpoints(router.Blueprint):
                 data=f"no manga found with id: {manga_id!r}",
             ).into_response()
 
-        return DataResponse(status=200, data=dict(row))  # noqa
+        etag = row_etag(self.app, row)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response.headers["ETag"] = etag
+        return DataResponse(status=200, data=row)  # noqa
+
+    @router.endpoint(
+        "/{manga_id:str}/similar",
+        endpoint_name="Get Similar Manga",
+        methods=["GET"],
+        response_model=SimilarResponse,
+        responses={
+            404: {
+                "model": StandardResponse
+            },
+            503: {
+                "model": StandardResponse,
+                "description": "The catalog snapshot is still loading."
+            }
+        },
+        tags=["Manga"]
+    )
+    async def get_similar_manga(self, manga_id: str, limit: conint(gt=0, le=50) = 10):
+        """ Gets the manga sharing the most genres with the given one, favouring higher ratings. """
+
+        if not self.app.catalog.ready:
+            return StandardResponse(
+                status=503,
+                data="similar titles are temporarily unavailable",
+            ).into_response()
+
+        hits = self.app.catalog.similar("manga", manga_id, limit)
+        if hits is None:
+            return StandardResponse(
+                status=404,
+                data=f"no manga found with id: {manga_id!r}",
+            ).into_response()
+
+        return SimilarResponse(status=200, data=with_genre_names(self.app, hits))  # noqa
+
+    @router.endpoint(
+        "/bulk",
+        endpoint_name="Bulk Add Manga",
+        methods=["POST"],
+        response_model=IngestResponse,
+        responses={
+            413: {
+                "model": StandardResponse,
+                "description": "Too many items were sent in one request."
+            },
+            422: {
+                "model": StandardResponse,
+                "description": "The body is not valid json or an item is invalid."
+            }
+        },
+        tags=["Manga"]
+    )
+    async def bulk_add_manga(self, request: Request):
+        """
+        Adds or updates many manga at once. The body is a JSON array of the
+        same payloads ``POST /`` takes, or NDJSON with one payload per line
+        when sent as ``application/x-ndjson``. Returns the id of each title.
+        """
+
+        try:
+            payloads = await read_ingest_payload(request)
+        except IngestError as e:
+            return StandardResponse(status=e.status, data=e.message).into_response()
+
+        ids = await bulk_ingest(self.app, "manga", payloads)
+        return IngestResponse(status=200, data=ids)  # noqa
 
 
 class GenreData(BaseModel):
@@ -286,17 +1319,15 @@ class GenreEndpoints(router.Blueprint):
         tags=["Genres"],
     )
     async def get_genre_with_id(self, genre_id: int):
-        row = await self.app.pool.fetchrow("""
-        SELECT id, name FROM api_genres WHERE id = $1;
-        """, genre_id)
+        name = self.app.genres.get(genre_id)
 
-        if row is None:
+        if name is None:
             return StandardResponse(
                 status=404,
                 data=f"genre does not exist with id {genre_id!r}",
             ).into_response()
 
-        return GenreResponse(status=200, data=dict(row))  # noqa
+        return GenreResponse(status=200, data={"id": genre_id, "name": name})  # noqa
 
     @router.endpoint(
         "/raw/{genre_name:str}",
@@ -311,17 +1342,15 @@ class GenreEndpoints(router.Blueprint):
         tags=["Genres"],
     )
     async def get_genre_with_name(self, genre_name: str):
-        row = await self.app.pool.fetchrow("""
-        SELECT id, name FROM api_genres WHERE name = $1;
-        """, genre_name)
+        genre_id = self.app.genres.get_by_name(genre_name)
 
-        if row is None:
+        if genre_id is None:
             return StandardResponse(
                 status=404,
                 data=f"genre does not exist with name {genre_name!r}",
             ).into_response()
 
-        return GenreResponse(status=200, data=dict(row))  # noqa
+        return GenreResponse(status=200, data={"id": genre_id, "name": genre_name})  # noqa
 
     @router.endpoint(
         "/flags/{flags:int}",
@@ -334,13 +1363,20 @@ class GenreEndpoints(router.Blueprint):
             }
         },
         tags=["Genres"],
+        cache_control="public, max-age=3600",
     )
-    async def get_genre_from_flags(self, flags: int):
-        rows = await self.app.pool.fetch("""
-        SELECT name FROM api_genres WHERE id & $1 != 0;
-        """, flags)
+    async def get_genre_from_flags(self, flags: int, request: Request, response: Response):
+        etag = f'"{flags}-{self.app.genres.digest}"'
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response.headers["ETag"] = etag
+        genres = [
+            {"id": genre_id, "name": name}
+            for genre_id, name in self.app.genres.items(flags)
+        ]
 
-        return GenreFlagsResponse(status=200, data=[row['name'] for row in rows])  # noqa
+        return GenreFlagsResponse(status=200, data=genres)  # noqa
 
     @router.endpoint(
         "/flags",
@@ -358,20 +1394,161 @@ class GenreEndpoints(router.Blueprint):
         if len(genres) == 0:
             return StandardResponse(status=200, data='0')
 
-        rows = await self.app.pool.fetch("""
-        SELECT id FROM api_genres WHERE name = any($1::text[]);
-        """, genres)
+        flags = self.app.genres.encode(genres)
+        return StandardResponse(status=200, data=str(flags))
+
 
-        mapper = [row['id'] for row in rows]
+class IndexJobStatus(BaseModel):
+    worker: str
+    state: str
+    locked: bool
+    progress: dict
+    started_at: datetime
+    updated_at: datetime
 
-        flags = reduce(or_, mapper) if genres else 0
-        return StandardResponse(status=200, data=str(flags))
+
+class IndexJobStatusResponse(StandardResponse):
+    data: IndexJobStatus
+
+
+class SearchCacheStats(BaseModel):
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+
+
+class SearchCacheStatsResponse(StandardResponse):
+    data: Dict[str, SearchCacheStats]
+
+
+class SearchEndpoints(router.Blueprint):
+    __base_route__ = "/data/search"
+
+    def __init__(self, app: Backend):
+        self.app = app
+
+    @router.endpoint(
+        "/status",
+        endpoint_name="Get Search Index Status",
+        methods=["GET"],
+        response_model=IndexJobStatusResponse,
+        responses={
+            404: {
+                "model": StandardResponse,
+                "description": "No worker has run the index job yet."
+            }
+        },
+        tags=["Search"],
+    )
+    async def get_index_status(self):
+        """
+        Gets the state of the search index job, which worker last held the
+        index lock and how far through syncing each index it has got.
+        """
+
+        status = await self.app.meili.job_status(self.app)
+        if status is None:
+            return StandardResponse(
+                status=404,
+                data="the search index job has not run yet",
+            ).into_response()
+
+        return IndexJobStatusResponse(status=200, data=status)  # noqa
+
+    @router.endpoint(
+        "/cache",
+        endpoint_name="Get Search Cache Stats",
+        methods=["GET"],
+        response_model=SearchCacheStatsResponse,
+        tags=["Search"],
+    )
+    async def get_cache_stats(self):
+        """ Gets the size and hit / miss counters of each index's search cache. """
+
+        return SearchCacheStatsResponse(status=200, data=self.app.meili.search_cache_stats())  # noqa
+
+
+class LoaderStats(BaseModel):
+    requests: int
+    batches: int
+    keys_loaded: int
+    mean_batch_size: float
+    recent_mean_batch_size: float
+    recent_max_batch_size: int
+    recent_mean_wait_ms: float
+    recent_max_wait_ms: float
+
+
+class LoaderStatsResponse(StandardResponse):
+    data: Dict[str, LoaderStats]
+
+
+class RowCacheStats(BaseModel):
+    size: int
+    maxsize: int
+    ttl: float
+    stale_ttl: float
+    hits: int
+    stale_hits: int
+    misses: int
+    refresh_errors: int
+
+
+class RowCacheStatsResponse(StandardResponse):
+    data: Dict[str, RowCacheStats]
+
+
+class StatsEndpoints(router.Blueprint):
+    __base_route__ = "/data/stats"
+
+    def __init__(self, app: Backend, loaders: Dict[str, BatchLoader]):
+        self.app = app
+        self.loaders = loaders
+
+    @router.endpoint(
+        "/loaders",
+        endpoint_name="Get Loader Stats",
+        methods=["GET"],
+        response_model=LoaderStatsResponse,
+        tags=["Stats"],
+    )
+    async def get_loader_stats(self):
+        """
+        Gets how well single id lookups are being coalesced into batched
+        queries on this worker, the recent figures cover the last 256 batches.
+        """
+
+        stats = {name: loader.stats() for name, loader in self.loaders.items()}
+        return LoaderStatsResponse(status=200, data=stats)  # noqa
+
+    @router.endpoint(
+        "/rows",
+        endpoint_name="Get Row Cache Stats",
+        methods=["GET"],
+        response_model=RowCacheStatsResponse,
+        tags=["Stats"],
+    )
+    async def get_row_cache_stats(self):
+        """
+        Gets the size and hit counters of each index's row cache on this
+        worker, stale hits were served while a refresh ran in the background.
+        """
+
+        stats = {index: cache.stats() for index, cache in self.app.catalog.row_cache.items()}
+        return RowCacheStatsResponse(status=200, data=stats)  # noqa
 
 
 def setup(app):
-    app.add_blueprint(AnimeEndpoints(app))
-    app.add_blueprint(MangaEndpoints(app))
+    anime = AnimeEndpoints(app)
+    manga = MangaEndpoints(app)
+
+    app.add_blueprint(anime)
+    app.add_blueprint(manga)
     app.add_blueprint(GenreEndpoints(app))
+    app.add_blueprint(SearchEndpoints(app))
+    app.add_blueprint(StatsEndpoints(app, {"anime": anime.loader, "manga": manga.loader}))
 
 
 
@@ -0,0 +1,134 @@
+import zlib
+import router
+
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import conint
+
+from server import Backend
+from utils import settings
+from utils.responders import StandardResponse
+
+WARMUP_QUERY = """
+    SELECT json_build_object(
+        'guild_id', guilds.guild_id::text,
+        'release_hook', release.webhook_url,
+        'news_hook', news.webhook_url,
+        'aliases', coalesce(aliases.aliases, '[]'::json)
+    )::text AS line
+    FROM (
+        SELECT guild_id FROM guild_events_hooks_release WHERE {match}
+        UNION
+        SELECT guild_id FROM guild_events_hooks_news WHERE {match}
+        UNION
+        SELECT guild_id FROM guild_command_aliases WHERE {match}
+    ) AS guilds
+    LEFT JOIN guild_events_hooks_release AS release USING (guild_id)
+    LEFT JOIN guild_events_hooks_news AS news USING (guild_id)
+    LEFT JOIN (
+        SELECT
+            guild_id,
+            json_agg(json_build_object('alias', alias, 'command_id', command_id)) AS aliases
+        FROM guild_command_aliases
+        WHERE {match}
+        GROUP BY guild_id
+    ) AS aliases USING (guild_id)
+    ORDER BY guilds.guild_id
+"""
+
+# Both take two parameters so the query text only differs in the filter.
+RANGE_MATCH = "guild_id BETWEEN $1 AND $2"
+SHARD_MATCH = "(guild_id >> 22) % $2 = $1"
+
+
+async def stream_warmup(app: Backend, match: str, args: tuple, compress: bool) -> AsyncIterator[bytes]:
+    """
+    Streams one NDJSON line per guild, the lines are built by postgres and
+    read off a server side cursor a batch at a time.
+    """
+
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    async with app.pool.acquire() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(WARMUP_QUERY.format(match=match), *args)
+            while True:
+                rows = await cursor.fetch(settings.SHARD_WARMUP_BATCH_SIZE)
+                if len(rows) == 0:
+                    break
+
+                chunk = "".join(f"{row['line']}\n" for row in rows).encode()
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
+
+
+class ShardWarmupBlueprint(router.Blueprint):
+    __base_route__ = "/shards"
+
+    def __init__(self, app: Backend):
+        self.app = app
+
+    @router.endpoint(
+        "/warmup",
+        endpoint_name="Get Shard Warmup State",
+        methods=["GET"],
+        response_class=StreamingResponse,
+        responses={
+            200: {
+                "content": {"application/x-ndjson": {}},
+                "description": "One line per guild with its hooks and aliases."
+            },
+            422: {
+                "model": StandardResponse,
+                "description": "Neither a full guild range nor a full shard was given."
+            }
+        },
+        tags=["Shards"]
+    )
+    async def get_warmup_state(
+        self,
+        request: Request,
+        guild_from: Optional[int] = None,
+        guild_to: Optional[int] = None,
+        shard_id: Optional[conint(ge=0)] = None,
+        shard_count: Optional[conint(gt=0)] = None,
+    ):
+        """
+        Gets the release hook, news hook and aliases of every guild in a
+        guild id range or on a shard as NDJSON, ``guild_id`` is a string.
+        Guilds with none of them are left out. The body is gzipped when the
+        client accepts it.
+        """
+        # todo auth
+
+        if guild_from is not None and guild_to is not None:
+            match, args = RANGE_MATCH, (guild_from, guild_to)
+        elif shard_id is not None and shard_count is not None and shard_id < shard_count:
+            match, args = SHARD_MATCH, (shard_id, shard_count)
+        else:
+            return StandardResponse(
+                status=422,
+                data="query must contain guild_from and guild_to or a valid shard_id and shard_count",
+            ).into_response()
+
+        compress = "gzip" in request.headers.get("accept-encoding", "")
+        headers = {"Vary": "Accept-Encoding"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+
+        return StreamingResponse(
+            stream_warmup(self.app, match, args, compress),
+            media_type="application/x-ndjson",
+            headers=headers,
+        )
+
+
+def setup(app):
+    app.add_blueprint(ShardWarmupBlueprint(app))
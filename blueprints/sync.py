@@ -0,0 +1,146 @@
+import enum
+import orjson
+import router
+
+from typing import List, Optional
+
+from fastapi import Query
+from pydantic import BaseModel, conint
+
+from server import Backend
+from utils.responders import StandardResponse
+
+
+class SyncTable(enum.Enum):
+    bot_commands = "bot_commands"
+    user_command_aliases = "user_command_aliases"
+    guild_command_aliases = "guild_command_aliases"
+    guild_events_hooks_release = "guild_events_hooks_release"
+    guild_events_hooks_news = "guild_events_hooks_news"
+
+
+class Change(BaseModel):
+    version: int
+    table: str
+    op: str
+    data: Optional[dict]
+
+
+class ChangesResults(BaseModel):
+    version: int
+    more: bool
+    changes: List[Change]
+
+
+class ChangesResponse(StandardResponse):
+    data: ChangesResults
+
+
+class VersionResponse(StandardResponse):
+    data: int
+
+
+class SyncBlueprint(router.Blueprint):
+    __base_route__ = "/sync"
+
+    def __init__(self, app: Backend):
+        self.app = app
+
+    async def pruned_version(self) -> int:
+        version = await self.app.pool.fetchval("""
+            SELECT version FROM api_collection_versions WHERE name = 'sync_changelog_pruned';
+        """)
+        return version or 0
+
+    @router.endpoint(
+        "/version",
+        endpoint_name="Get Sync Version",
+        methods=["GET"],
+        response_model=VersionResponse,
+        tags=["Sync"]
+    )
+    async def get_version(self):
+        """
+        Gets the latest change log version. Read this before downloading the
+        full lists, then ask for the changes since it to catch up.
+        """
+        # todo auth
+
+        version = await self.app.pool.fetchval("""
+            SELECT greatest(
+                (SELECT max(version) FROM sync_changelog),
+                (SELECT version FROM api_collection_versions WHERE name = 'sync_changelog_pruned'),
+                0
+            );
+        """)
+
+        return VersionResponse(status=200, data=version)
+
+    @router.endpoint(
+        "/changes",
+        endpoint_name="Get Changes Since Version",
+        methods=["GET"],
+        response_model=ChangesResponse,
+        responses={
+            410: {
+                "model": StandardResponse,
+                "description": "The changes after the given version were pruned, do a full resync."
+            }
+        },
+        tags=["Sync"]
+    )
+    async def get_changes(
+        self,
+        since: conint(ge=0),
+        limit: conint(gt=0, le=5000) = 1000,
+        tables: Optional[List[SyncTable]] = Query(None),
+    ):
+        """
+        Gets the inserts, updates and deletes made after the given version in
+        the order they committed. ``data`` is the row after an insert or
+        update, the old row for a delete and null for a truncate. Pass the
+        returned ``version`` as ``since`` next time, ``more`` means another
+        page is waiting.
+        """
+        # todo auth
+
+        if since < await self.pruned_version():
+            return StandardResponse(
+                status=410,
+                data=f"changes after version {since} are no longer kept",
+            ).into_response()
+
+        names = [table.value for table in tables] if tables else None
+        rows = await self.app.pool.fetch("""
+            SELECT version, table_name, op, data
+            FROM sync_changelog
+            WHERE
+                version > $1
+                AND ($3::text[] IS NULL OR table_name = any($3::text[]))
+            ORDER BY version
+            LIMIT $2;
+        """, since, limit + 1, names)
+
+        more = len(rows) > limit
+        changes = [
+            {
+                "version": row['version'],
+                "table": row['table_name'],
+                "op": row['op'],
+                "data": orjson.loads(row['data']) if row['data'] is not None else None,
+            }
+            for row in rows[:limit]
+        ]
+
+        return ChangesResponse(  # noqa
+            status=200,
+            data={
+                "version": changes[-1]['version'] if changes else since,
+                "more": more,
+                "changes": changes,
+            }
+        )
+
+
+def setup(app):
+    app.add_blueprint(SyncBlueprint(app))
@@ -6,6 +6,7 @@ import utils
 from fastapi import Request, Response
 from fastapi.responses import ORJSONResponse
 from server import Backend
+from utils.responders import cache_control_route
 
 BASE_PATH = "/v0"
 APP_FILES = [
@@ -23,12 +24,18 @@ ORIGINS = {
 
 def import_callback(app_: Backend, endpoint: t.Union[router.Endpoint, router.Websocket]):
     if isinstance(endpoint, router.Endpoint):
-        app_.add_api_route(
+        extra = dict(endpoint.extra)
+
+        cache_control = extra.pop("cache_control", None)
+        if cache_control is not None:
+            extra["route_class_override"] = cache_control_route(cache_control)
+
+        app_.router.add_api_route(
             f"{BASE_PATH}{endpoint.route}",
             endpoint.callback,
             name=endpoint.name,
             methods=endpoint.methods,
-            **endpoint.extra)
+            **extra)
     else:
         raise NotImplementedError()
 
@@ -1,45 +1,36 @@
-import meilisearch
-from typing import Optional
+import os
+import socket
+import asyncio
+import logging
+import aiohttp
+import orjson
+from functools import partial
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
 
 from fastapi import FastAPI
-from asyncpg import create_pool, Pool
+from asyncpg import create_pool, connect, Connection, Pool
 
-from utils import settings
+from utils import (
+    settings,
+    chunk_n,
+    TTLCache,
+    ReadThroughCache,
+    CircuitBreaker,
+    LocalSearchEngine,
+    WriteBehindQueue,
+    PrefixIndex,
+    GenreRegistry,
+    CatalogSnapshot,
+    CommandCatalog,
+    AliasResolver,
+)
 
+logger = logging.getLogger("crunchy.search")
 
-class MeiliEngine:
-    def __init__(self):
-        self.meili = meilisearch.Client(settings.SEARCH_ENGINE_URI)
-        self._anime = self.meili.index("anime")
-        self._manga = self.meili.index("manga")
-
-        try:
-            self._anime.delete_all_documents()
-        except meilisearch.client.MeiliSearchApiError:
-            pass
-        try:
-            self._manga.delete_all_documents()
-        except meilisearch.client.MeiliSearchApiError:
-            pass
-
-        self._anime.update_settings({
-            "searchableAttributes": ["title_english", "title", "title_japanese", "description", "genres"],
-        })
-
-        self._manga.update_settings({
-            "searchableAttributes": ["title", "description", "genres"],
-        })
 
-    @property
-    def anime(self):
-        return self._anime
-
-    @property
-    def manga(self):
-        return self._manga
-
-    async def update_indexes(self, app: "Backend"):
-        rows = await app.pool.fetch("""
+SEARCH_DOCUMENT_QUERIES = {
+    "anime": """
         SELECT 
             title, 
             title_english,
@@ -49,30 +40,749 @@ class MeiliEngine:
             img_url, 
             link, 
             crunchyroll,
-            array(SELECT name FROM api_genres WHERE id & api_anime_data.genres != 0) as genres, 
+            genres, 
             id 
-        FROM api_anime_data;
-        """)
-
-        if len(rows) > 0:
-            rows = [dict(row) for row in rows]
-            self.anime.add_documents(rows, primary_key="id")
-
-        rows = await app.pool.fetch("""
+        FROM api_anime_data
+    """,
+    "manga": """
         SELECT 
             title, 
             description, 
             rating, 
             img_url, 
             link, 
-            array(SELECT name FROM api_genres WHERE id & api_manga_data.genres != 0) as genres, 
+            genres, 
             id 
-        FROM api_manga_data;
-        """)
+        FROM api_manga_data
+    """,
+}
+
+
+# Arbitrary key for the postgres advisory lock guarding the index job.
+SEARCH_INDEX_LOCK_ID = 0x6d65696c69
+
+# Arbitrary key for the advisory lock serialising writes to the change log.
+SYNC_CHANGELOG_LOCK_ID = 0x73796e636c6f67
+
+# Tables whose row changes are recorded in ``sync_changelog``.
+SYNC_CHANGELOG_TABLES = [
+    "bot_commands",
+    "user_command_aliases",
+    "guild_command_aliases",
+    "guild_events_hooks_release",
+    "guild_events_hooks_news",
+]
+
+SEARCHABLE_ATTRIBUTES = {
+    "anime": ["title_english", "title", "title_japanese", "description", "genres"],
+    "manga": ["title", "description", "genres"],
+}
+
+FILTERABLE_ATTRIBUTES = ["genres", "rating"]
+SORTABLE_ATTRIBUTES = ["rating"]
+
+AUTOCOMPLETE_ATTRIBUTES = ["title", "title_english", "title_japanese"]
+
+SEARCH_INDEX_TABLES = {
+    "anime": "api_anime_data",
+    "manga": "api_manga_data",
+}
+
+
+class SearchUnavailable(Exception):
+    """ Raised when meili is failing and the fallback engine isn't loaded yet. """
+
+
+class MeiliEngine:
+    def __init__(self, genres: GenreRegistry):
+        self.genres = genres
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._search_limiter: Optional[asyncio.Semaphore] = None
+
+        self.search_cache: Dict[str, TTLCache] = {
+            index: TTLCache(settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL)
+            for index in SEARCH_DOCUMENT_QUERIES
+        }
+        self._cache_generation: Dict[str, int] = {index: 0 for index in SEARCH_DOCUMENT_QUERIES}
+
+        self.reindex_progress: Dict[str, dict] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._job_app: Optional["Backend"] = None
+
+        self.breaker = CircuitBreaker(settings.SEARCH_BREAKER_FAILURES, settings.SEARCH_BREAKER_RESET)
+        self.fallback = LocalSearchEngine(SEARCHABLE_ATTRIBUTES)
+        self.autocomplete: Dict[str, PrefixIndex] = {
+            index: PrefixIndex(AUTOCOMPLETE_ATTRIBUTES) for index in SEARCH_DOCUMENT_QUERIES
+        }
+
+        self.write_queues: Dict[str, WriteBehindQueue] = {
+            index: WriteBehindQueue(
+                partial(self._flush_documents, index),
+                name=f"{index} search writes",
+                batch_size=settings.SEARCH_WRITE_BATCH_SIZE,
+                flush_interval=settings.SEARCH_WRITE_FLUSH_INTERVAL,
+                max_pending=settings.SEARCH_WRITE_MAX_PENDING,
+                max_retries=settings.SEARCH_WRITE_MAX_RETRIES,
+            )
+            for index in SEARCH_DOCUMENT_QUERIES
+        }
+        self._pushes: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """
+        Opens the pooled keep-alive session used by the async search path,
+        this must be called from within the running event loop.
+        """
+        connector = aiohttp.TCPConnector(
+            limit=settings.SEARCH_ENGINE_MAX_CONNECTIONS,
+            keepalive_timeout=settings.SEARCH_ENGINE_KEEPALIVE,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.SEARCH_ENGINE_TIMEOUT,
+            connect=settings.SEARCH_ENGINE_CONNECT_TIMEOUT,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self._search_limiter = asyncio.Semaphore(settings.SEARCH_ENGINE_MAX_CONCURRENCY)
+
+        for queue in self.write_queues.values():
+            queue.start()
+
+        for index, attributes in SEARCHABLE_ATTRIBUTES.items():
+            try:
+                await self._request(
+                    "PATCH",
+                    f"/indexes/{index}/settings",
+                    json={
+                        "searchableAttributes": attributes,
+                        "filterableAttributes": FILTERABLE_ATTRIBUTES,
+                        "sortableAttributes": SORTABLE_ATTRIBUTES,
+                    },
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("could not configure search index %s: %r", index, e)
+
+    async def close(self):
+        for queue in self.write_queues.values():
+            await queue.close(settings.SEARCH_WRITE_DRAIN_TIMEOUT)
+
+        # Unfinished pushes are left to the outbox sync.
+        for task in list(self._pushes):
+            task.cancel()
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        assert self._session is not None, "search session was not initialised"
+
+        url = f"{settings.SEARCH_ENGINE_URI.rstrip('/')}{path}"
+        async with self._session.request(method, url, **kwargs) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    @staticmethod
+    def _search_body(query: str, options: dict) -> dict:
+        """
+        Converts the engine agnostic search options into a meili request,
+        ``genres`` must all match, ``min_rating`` is inclusive and ``sort``
+        is a meili sort rule such as ``rating:desc``.
+        """
+        body = {"q": query}
+        filters = []
+        for key, value in options.items():
+            if key == "genres":
+                filters.extend(f"genres = {orjson.dumps(name).decode()}" for name in value)
+            elif key == "min_rating":
+                if value is not None:
+                    filters.append(f"rating >= {float(value)}")
+            elif key == "sort":
+                if value is not None:
+                    body["sort"] = [value]
+            else:
+                body[key] = value
+
+        if len(filters) > 0:
+            body["filter"] = " AND ".join(filters)
+
+        return body
+
+    async def search(self, index: str, query: str, options: Optional[dict] = None) -> dict:
+        """
+        Searches the given index without blocking the event loop, the number
+        of in-flight requests to meili is bounded by the search limiter.
+
+        Results are cached per index on the normalised query and options.
+        """
+        body = self._search_body(query, options or {})
+
+        cache = self.search_cache[index]
+        key = (" ".join(query.lower().split()), orjson.dumps(options, option=orjson.OPT_SORT_KEYS))
+        results = cache.get(key)
+        if results is not None:
+            return results
+
+        generation = self._cache_generation[index]
+        if self.breaker.allow():
+            try:
+                async with self._search_limiter:
+                    results = await self._request("POST", f"/indexes/{index}/search", json=body)
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500:
+                    raise
+                self.breaker.record_failure()
+                logger.warning("meili search failed, using fallback: %r", e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                logger.warning("meili search failed, using fallback: %r", e)
+            else:
+                self.breaker.record_success()
+
+        if results is None:
+            if not self.fallback.ready:
+                raise SearchUnavailable("search engine is unavailable")
+            return self.fallback.search(index, query, options)
+
+        # Don't repopulate the cache with results fetched before an invalidation.
+        if generation == self._cache_generation[index]:
+            cache.set(key, results)
+
+        return results
+
+    def _documents(self, rows: List[Any]) -> List[dict]:
+        """ Turns catalog rows into search documents with named genres. """
+
+        documents = [dict(row) for row in rows]
+        names = self.genres.decode_many(doc['genres'] for doc in documents)
+        for doc, genres in zip(documents, names):
+            doc['genres'] = genres
+        return documents
+
+    def _update_local(self, index: str, documents: List[dict]):
+        self.fallback.add_documents(index, documents)
 
+        prefixes = self.autocomplete[index]
+        if len(documents) == 1:
+            prefixes.add(documents[0])
+        else:
+            prefixes.add_many(documents)
+
+    def _delete_local(self, index: str, ids: List[str]):
+        self.fallback.delete_documents(index, ids)
+
+        prefixes = self.autocomplete[index]
+        for doc_id in ids:
+            prefixes.remove(doc_id)
+
+    def apply_local_changes(self, index: str, rows: List[Any], deleted: List[str]):
+        """
+        Brings the fallback engine and autocomplete index in line with rows
+        changed by any worker, ``rows`` come from ``SEARCH_DOCUMENT_QUERIES``.
+        """
         if len(rows) > 0:
-            rows = [dict(row) for row in rows]
-            self.manga.add_documents(rows, primary_key="id")
+            self._update_local(index, self._documents(rows))
+        if len(deleted) > 0:
+            self._delete_local(index, deleted)
+
+    def complete(self, index: str, prefix: str, limit: int) -> List[dict]:
+        if not self.fallback.ready:
+            raise SearchUnavailable("autocomplete index is still loading")
+        return self.autocomplete[index].complete(prefix, limit)
+
+    async def load_fallback(self, app: "Backend"):
+        """
+        Builds the in-process fallback engine and the autocomplete prefix
+        indexes out of the catalog tables, documents no longer in the tables
+        are dropped when it's run again.
+        """
+
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                for index, query in SEARCH_DOCUMENT_QUERIES.items():
+                    seen = set()
+                    cursor = await conn.cursor(query)
+                    while True:
+                        rows = await cursor.fetch(settings.SEARCH_INDEX_BATCH_SIZE)
+                        if len(rows) == 0:
+                            break
+                        self._update_local(index, self._documents(rows))
+                        seen.update(row['id'] for row in rows)
+
+                    stale = set(self.fallback.indexes[index].documents).difference(seen)
+                    if len(stale) > 0:
+                        self._delete_local(index, list(stale))
+
+        self.fallback.ready = True
+        logger.info(
+            "fallback search engine loaded: %s",
+            {index: len(local) for index, local in self.fallback.indexes.items()},
+        )
+
+    def invalidate_search_cache(self, index: str):
+        self._cache_generation[index] += 1
+        self.search_cache[index].clear()
+
+    def search_cache_stats(self) -> Dict[str, dict]:
+        return {index: cache.stats() for index, cache in self.search_cache.items()}
+
+    async def add_documents(self, index: str, documents: List[dict]) -> dict:
+        return await self._request(
+            "POST",
+            f"/indexes/{index}/documents",
+            params={"primaryKey": "id"},
+            json=documents,
+        )
+
+    async def queue_documents(self, index: str, documents: List[dict]):
+        """
+        Upserts documents through the index's write-behind queue, the local
+        fallback engine and autocomplete index are updated straight away.
+        """
+        self._update_local(index, documents)
+
+        queue = self.write_queues[index]
+        for doc in documents:
+            await queue.put(doc["id"], doc)
+
+    def push_documents(self, index: str, documents: List[dict]):
+        """
+        Upserts a large batch of documents from a background task so the
+        caller doesn't wait on meili, the local fallback engine and
+        autocomplete index are updated straight away.
+        """
+        self._update_local(index, documents)
+
+        task = asyncio.create_task(self._push_documents(index, documents))
+        self._pushes.add(task)
+        task.add_done_callback(self._pushes.discard)
+
+    async def _push_documents(self, index: str, documents: List[dict]):
+        try:
+            for batch in chunk_n(documents, settings.SEARCH_INDEX_BATCH_SIZE):
+                task = await self.add_documents(index, batch)
+                await self.wait_for_task(index, task)
+                self.invalidate_search_cache(index)
+        except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+            # The rows are still in the outbox, the next sync pushes them.
+            logger.warning("failed to push %d documents to %s: %r", len(documents), index, e)
+
+    async def _flush_documents(self, index: str, documents: List[dict]):
+        # Meili only queues the documents, searches keep returning the old
+        # results until the task is processed so invalidate after that.
+        task = await self.add_documents(index, documents)
+        await self.wait_for_task(index, task)
+        self.invalidate_search_cache(index)
+
+    async def delete_documents(self, index: str, ids: List[str]) -> dict:
+        return await self._request("POST", f"/indexes/{index}/documents/delete-batch", json=ids)
+
+    async def delete_all_documents(self, index: str) -> dict:
+        return await self._request("DELETE", f"/indexes/{index}/documents")
+
+    async def index_exists(self, index: str) -> bool:
+        try:
+            await self._request("GET", f"/indexes/{index}")
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+    async def run_index_job(self, app: "Backend"):
+        """
+        Syncs the search indexes at startup and then every sync interval,
+        each run advances the high-water mark and trims the outbox so it
+        only ever holds the writes since the last run.
+        """
+        while True:
+            try:
+                await self.sync_indexes_once(app)
+            except Exception:
+                logger.exception("search index job failed")
+
+            await asyncio.sleep(settings.SEARCH_SYNC_INTERVAL)
+
+    async def sync_indexes_once(self, app: "Backend"):
+        """
+        Syncs the search indexes if no other worker is already doing so,
+        leadership is decided by a session level postgres advisory lock so
+        it is released automatically should the leading worker die.
+        """
+        async with app.pool.acquire() as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock($1);", SEARCH_INDEX_LOCK_ID)
+            if not locked:
+                logger.debug("search index job is held by another worker, skipping")
+                return
+
+            self._job_app = app
+            try:
+                await self._set_job_state(app, "running")
+                await self.update_indexes(app)
+                await self._set_job_state(app, "finished")
+            except Exception:
+                await self._set_job_state(app, "failed")
+                raise
+            finally:
+                self._job_app = None
+                await conn.execute("SELECT pg_advisory_unlock($1);", SEARCH_INDEX_LOCK_ID)
+
+    async def _set_job_state(self, app: "Backend", state: str):
+        await app.pool.execute("""
+            INSERT INTO search_sync_jobs (job, worker, state, progress, started_at, updated_at)
+            VALUES ('index', $1, $2, $3::jsonb, now(), now())
+            ON CONFLICT (job)
+            DO UPDATE SET
+                worker = excluded.worker,
+                state = excluded.state,
+                progress = excluded.progress,
+                started_at = CASE 
+                    WHEN excluded.state = 'running' THEN excluded.started_at 
+                    ELSE search_sync_jobs.started_at 
+                END,
+                updated_at = excluded.updated_at;
+        """, self.worker_id, state, orjson.dumps(self.reindex_progress).decode())
+
+    async def _report_progress(self):
+        if self._job_app is None:
+            return
+
+        await self._job_app.pool.execute("""
+            UPDATE search_sync_jobs 
+            SET progress = $1::jsonb, updated_at = now()
+            WHERE job = 'index';
+        """, orjson.dumps(self.reindex_progress).decode())
+
+    async def job_status(self, app: "Backend") -> Optional[dict]:
+        row = await app.pool.fetchrow("""
+            SELECT 
+                worker, 
+                state, 
+                progress::text AS progress, 
+                started_at, 
+                updated_at,
+                EXISTS (
+                    SELECT 1 FROM pg_locks 
+                    WHERE locktype = 'advisory' AND granted 
+                    AND ((classid::bigint << 32) | objid::bigint) = $1
+                ) AS locked
+            FROM search_sync_jobs
+            WHERE job = 'index';
+        """, SEARCH_INDEX_LOCK_ID)
+
+        if row is None:
+            return None
+
+        status = dict(row)
+        status['progress'] = orjson.loads(status['progress'])
+        return status
+
+    async def update_indexes(self, app: "Backend"):
+        """
+        Brings every search index up to date with the catalog tables, only the
+        rows listed in the outbox are pushed.
+        """
+        for index in SEARCH_DOCUMENT_QUERIES:
+            await self.sync_index(app, index)
+
+    async def sync_index(self, app: "Backend", index: str):
+        high_water = await app.pool.fetchval("""
+            SELECT high_water FROM search_sync_state WHERE index_name = $1;
+        """, index)
+
+        if high_water is None or not await self.index_exists(index):
+            await self.reindex(app, index)
+            return
+
+        # Seqs are handed out at insert rather than commit so a lower one can
+        # still show up later, the whole outbox is read instead of filtering on
+        # the high-water mark and only the seqs seen here are trimmed.
+        changes = await app.pool.fetch("""
+            SELECT seq, doc_id, deleted
+            FROM search_sync_outbox
+            WHERE index_name = $1
+            ORDER BY seq;
+        """, index)
+
+        if len(changes) == 0:
+            return
+
+        latest = {row['doc_id']: row['deleted'] for row in changes}
+        deleted = [doc_id for doc_id, is_deleted in latest.items() if is_deleted]
+        changed = [doc_id for doc_id, is_deleted in latest.items() if not is_deleted]
+        progress = self.reindex_progress[index] = {
+            "mode": "delta",
+            "total": len(latest),
+            "sent": 0,
+            "done": False,
+        }
+
+        for ids in chunk_n(changed, settings.SEARCH_INDEX_BATCH_SIZE):
+            rows = await app.pool.fetch(
+                f"{SEARCH_DOCUMENT_QUERIES[index]} WHERE id = any($1::text[]);",
+                ids,
+            )
+            if len(rows) > 0:
+                documents = self._documents(rows)
+                task = await self.add_documents(index, documents)
+                await self.wait_for_task(index, task)
+                self._update_local(index, documents)
+
+            progress["sent"] += len(ids)
+            await self._report_progress()
+
+        if len(deleted) > 0:
+            task = await self.delete_documents(index, deleted)
+            await self.wait_for_task(index, task)
+            self._delete_local(index, deleted)
+
+        self.invalidate_search_cache(index)
+        progress["sent"] += len(deleted)
+        progress["done"] = True
+        await self._set_high_water(app, index, [row['seq'] for row in changes])
+        await self._report_progress()
+
+    async def reindex(self, app: "Backend", index: str):
+        """ Rebuilds the given index from scratch out of the catalog table. """
+
+        # Anything not yet committed at this point is picked up by the next sync.
+        seqs = await app.pool.fetchval("""
+            SELECT coalesce(array_agg(seq), '{}') FROM search_sync_outbox WHERE index_name = $1;
+        """, index)
+
+        if await self.index_exists(index):
+            await self.delete_all_documents(index)
+
+        batch_size = settings.SEARCH_INDEX_BATCH_SIZE
+        max_in_flight = settings.SEARCH_INDEX_MAX_IN_FLIGHT
+
+        async with app.pool.acquire() as conn:
+            total = await conn.fetchval(f"SELECT count(*) FROM {SEARCH_INDEX_TABLES[index]};")
+            progress = self.reindex_progress[index] = {
+                "mode": "full",
+                "total": total,
+                "sent": 0,
+                "done": False,
+            }
+
+            # Rows are streamed through a server side cursor one page at a time
+            # so memory stays bound by the page size rather than the catalog.
+            pending: Deque[dict] = deque()
+            async with conn.transaction():
+                cursor = await conn.cursor(SEARCH_DOCUMENT_QUERIES[index])
+                while True:
+                    page = await cursor.fetch(batch_size * max_in_flight)
+                    if len(page) == 0:
+                        break
+
+                    for batch in chunk_n(page, batch_size):
+                        if len(pending) >= max_in_flight:
+                            await self.wait_for_task(index, pending.popleft())
+
+                        task = await self.add_documents(index, self._documents(batch))
+                        pending.append(task)
+
+                        progress["sent"] += len(batch)
+                        logger.info("reindexing %s: sent %d / %d documents", index, progress["sent"], total)
+                        await self._report_progress()
+
+            while pending:
+                await self.wait_for_task(index, pending.popleft())
+
+        self.invalidate_search_cache(index)
+        progress["done"] = True
+        await self._set_high_water(app, index, seqs)
+        await self._report_progress()
+
+    async def wait_for_task(self, index: str, task: dict) -> dict:
+        """ Polls meili until the given enqueued task has been processed. """
+
+        if "updateId" in task:
+            path = f"/indexes/{index}/updates/{task['updateId']}"
+        else:
+            path = f"/tasks/{task.get('taskUid', task.get('uid'))}"
+
+        while True:
+            status = await self._request("GET", path)
+            if status["status"] in ("succeeded", "processed"):
+                return status
+            if status["status"] == "failed":
+                raise RuntimeError(f"meili task on index {index!r} failed: {status.get('error')}")
+
+            await asyncio.sleep(settings.SEARCH_TASK_POLL_INTERVAL)
+
+    @staticmethod
+    async def _set_high_water(app: "Backend", index: str, seqs: List[int]):
+        """ Records a finished sync and trims exactly the outbox rows it pushed. """
+
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                    INSERT INTO search_sync_state (index_name, high_water)
+                    VALUES ($1, $2)
+                    ON CONFLICT (index_name)
+                    DO UPDATE SET high_water = greatest(search_sync_state.high_water, excluded.high_water);
+                """, index, max(seqs, default=0))
+                await conn.execute("""
+                    DELETE FROM search_sync_outbox 
+                    WHERE index_name = $1 AND seq = any($2::bigint[]);
+                """, index, seqs)
+
+
+class CatalogEngine:
+    """
+    Holds a columnar snapshot of each catalog table for browse queries, the
+    snapshots follow row changes announced on the ``catalog_changed``
+    channel which are batched up and re-read from postgres.
+    """
+
+    def __init__(self):
+        self.snapshots: Dict[str, CatalogSnapshot] = {
+            index: CatalogSnapshot() for index in SEARCH_INDEX_TABLES
+        }
+        self.similar_cache: Dict[str, TTLCache] = {
+            index: TTLCache(settings.SIMILAR_CACHE_SIZE, settings.SIMILAR_CACHE_TTL)
+            for index in SEARCH_INDEX_TABLES
+        }
+        self.row_cache: Dict[str, ReadThroughCache] = {
+            index: ReadThroughCache(settings.ROW_CACHE_SIZE, settings.ROW_CACHE_TTL, settings.ROW_CACHE_STALE_TTL)
+            for index in SEARCH_INDEX_TABLES
+        }
+        self.rankings: Dict[str, Dict[Optional[int], bytes]] = {}
+        self._ranked: Dict[str, tuple] = {}
+        self.ready = False
+        self._pending: Dict[str, Set[str]] = defaultdict(set)
+        self._flush: Optional[asyncio.Future] = None
+
+    def __getitem__(self, index: str) -> CatalogSnapshot:
+        return self.snapshots[index]
+
+    def similar(self, index: str, doc_id: str, limit: int) -> Optional[List[dict]]:
+        """
+        Gets the titles sharing the most genres with the given one, results
+        are cached until the snapshot changes.
+        """
+        snapshot = self.snapshots[index]
+        cache = self.similar_cache[index]
+
+        cached = cache.get((doc_id, limit))
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+
+        results = snapshot.similar(doc_id, limit)
+        if results is not None:
+            cache.set((doc_id, limit), (snapshot.version, results))
+        return results
+
+    async def load(self, app: "Backend"):
+        """
+        Reads every catalog row into the snapshots, rows the snapshots hold
+        that are no longer in the table are removed so this doubles as a
+        full resync.
+        """
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                for index, table in SEARCH_INDEX_TABLES.items():
+                    snapshot = self.snapshots[index]
+                    seen = set()
+                    cursor = await conn.cursor(f"SELECT id, title, rating, genres FROM {table}")
+                    while True:
+                        rows = await cursor.fetch(settings.SEARCH_INDEX_BATCH_SIZE)
+                        if len(rows) == 0:
+                            break
+                        snapshot.upsert_many(rows)
+                        seen.update(row['id'] for row in rows)
+
+                    for doc_id in set(filter(None, snapshot.ids)).difference(seen):
+                        snapshot.remove(doc_id)
+                    self.row_cache[index].clear()
+
+        self.ready = True
+        logger.info(
+            "catalog snapshots loaded: %s",
+            {index: len(snapshot) for index, snapshot in self.snapshots.items()},
+        )
+
+        for index in self.snapshots:
+            self.rank(app, index)
+
+    def rank(self, app: "Backend", index: str):
+        """
+        Rebuilds an index's top rated lists, overall and per genre, each is
+        kept as a ready to send response body. Skipped when neither the
+        snapshot nor the genres changed since the last build.
+        """
+        snapshot = self.snapshots[index]
+        built_from = (snapshot.version, app.genres.digest)
+        if self._ranked.get(index) == built_from:
+            return
+
+        ranked = snapshot.ranked(settings.RANKED_LIST_SIZE, app.genres.ids())
+        bodies = {}
+        for genre_id, rows in ranked.items():
+            names = app.genres.decode_many(row['genres'] for row in rows)
+            hits = [{**row, 'genres': genres} for row, genres in zip(rows, names)]
+            bodies[genre_id] = orjson.dumps({"status": 200, "data": hits})
+
+        self.rankings[index] = bodies
+        self._ranked[index] = built_from
+
+    async def run_rankings(self, app: "Backend"):
+        """ Keeps the ranked lists in step with the snapshots. """
+
+        while True:
+            await asyncio.sleep(settings.RANKED_LIST_REFRESH_INTERVAL)
+            if not self.ready:
+                continue
+
+            for index in self.snapshots:
+                try:
+                    self.rank(app, index)
+                except Exception:
+                    logger.exception("failed to rebuild ranked lists for %s", index)
+
+    async def changed(self, app: "Backend", payload: str):
+        index, _, doc_id = payload.partition(":")
+        if index not in self.snapshots:
+            return
+
+        # Cached rows are dropped straight away, only the snapshot waits on the batch.
+        self.row_cache[index].invalidate(doc_id)
+        self._pending[index].add(doc_id)
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._apply_changes(app))
+
+    async def _apply_changes(self, app: "Backend"):
+        await asyncio.sleep(settings.CATALOG_REFRESH_DELAY)
+
+        pending, self._pending = self._pending, defaultdict(set)
+        self._flush = None
+        for index, ids in pending.items():
+            try:
+                await self.refresh(app, index, list(ids))
+            except Exception:
+                logger.exception("failed to refresh %d %s rows, retrying", len(ids), index)
+
+                # Put the ids back so the next batch picks them up again.
+                self._pending[index].update(ids)
+                if self._flush is None:
+                    self._flush = asyncio.ensure_future(self._apply_changes(app))
+
+    async def refresh(self, app: "Backend", index: str, ids: List[str]):
+        # The full search documents are read so the local search indexes of
+        # every worker follow the change too, not just the snapshot.
+        rows = await app.pool.fetch(
+            f"{SEARCH_DOCUMENT_QUERIES[index]} WHERE id = any($1::text[]);",
+            ids,
+        )
+        deleted = list(set(ids).difference(row['id'] for row in rows))
+
+        snapshot = self.snapshots[index]
+        snapshot.upsert_many(rows)
+        for doc_id in deleted:
+            snapshot.remove(doc_id)
+
+        app.meili.apply_local_changes(index, rows, deleted)
 
 
 class Backend(FastAPI):
@@ -85,7 +795,23 @@ class Backend(FastAPI):
         self.secure_key = settings.SECURE_KEY
         self.bot_token = settings.BOT_AUTH
         self._pool: Optional[Pool] = None
-        self._search_client = MeiliEngine()
+        self._listener: Optional[Connection] = None
+        self._channels: Dict[str, Callable] = {}
+        self.genres = GenreRegistry()
+        self.commands = CommandCatalog()
+        self.aliases = AliasResolver(
+            settings.ALIAS_CACHE_SIZE,
+            settings.ALIAS_CACHE_TTL,
+            settings.ALIAS_CACHE_STALE_TTL,
+        )
+        self._search_client = MeiliEngine(self.genres)
+        self.catalog = CatalogEngine()
+        self._index_job: Optional[asyncio.Task] = None
+        self._fallback_job: Optional[asyncio.Task] = None
+        self._catalog_job: Optional[asyncio.Task] = None
+        self._ranking_job: Optional[asyncio.Task] = None
+        self._changelog_job: Optional[asyncio.Task] = None
+        self._relisten_job: Optional[asyncio.Task] = None
 
         self.on_event("startup")(self.startup)
         self.on_event("shutdown")(self.shutdown)
@@ -103,12 +829,107 @@ class Backend(FastAPI):
         self._pool = await create_pool(settings.POSTGRES_URI)
         await self.create_tables()
 
-        await self.meili.update_indexes(self)
+        await self.genres.refresh(self.pool)
+        await self.listen("api_genres_changed", self._genres_changed)
+        await self.commands.refresh(self.pool)
+        await self.listen("bot_commands_changed", lambda _: self.commands.refresh(self.pool))
+        await self.listen("user_command_aliases_changed", lambda payload: self.aliases.changed("user", payload))
+        await self.listen("guild_command_aliases_changed", lambda payload: self.aliases.changed("guild", payload))
+        await self.listen("catalog_changed", lambda payload: self.catalog.changed(self, payload))
+        self._catalog_job = asyncio.create_task(self.catalog.load(self))
+        self._ranking_job = asyncio.create_task(self.catalog.run_rankings(self))
+
+        await self.meili.start()
+        self._fallback_job = asyncio.create_task(self.meili.load_fallback(self))
+        self._index_job = asyncio.create_task(self.meili.run_index_job(self))
+        self._changelog_job = asyncio.create_task(self.prune_changelog())
 
     async def shutdown(self):
+        jobs = (
+            self._index_job,
+            self._fallback_job,
+            self._catalog_job,
+            self._ranking_job,
+            self._changelog_job,
+            self._relisten_job,
+        )
+        for job in jobs:
+            if job is not None and not job.done():
+                job.cancel()
+                try:
+                    await job
+                except asyncio.CancelledError:
+                    pass
+
+        await self.meili.close()
+
+        if self._listener is not None:
+            self._listener.remove_termination_listener(self._listener_lost)
+            await self._listener.close()
+
         if self._pool is not None:
             await self._pool.close()
 
+    async def listen(self, channel: str, callback: Callable[[str], Awaitable[Any]]):
+        """
+        Runs ``callback`` with the payload whenever a notification arrives on
+        the postgres channel, all channels share one connection kept outside
+        the pool and re-opened if it drops.
+        """
+        if self._listener is None:
+            self._listener = await connect(settings.POSTGRES_URI)
+            self._listener.add_termination_listener(self._listener_lost)
+
+        def notified(_conn, _pid, _channel, payload):
+            asyncio.ensure_future(callback(payload))
+
+        self._channels[channel] = notified
+        await self._listener.add_listener(channel, notified)
+
+    def _listener_lost(self, _conn):
+        logger.warning("lost the postgres listener connection, reconnecting")
+        self._listener = None
+        self._relisten_job = asyncio.ensure_future(self._relisten())
+
+    async def _relisten(self):
+        delay = 1.0
+        while True:
+            try:
+                listener = await connect(settings.POSTGRES_URI)
+                break
+            except Exception as e:
+                logger.warning("could not reconnect the postgres listener: %r", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+        listener.add_termination_listener(self._listener_lost)
+        for channel, notified in self._channels.items():
+            await listener.add_listener(channel, notified)
+        self._listener = listener
+
+        try:
+            await self.resync()
+        except Exception:
+            logger.exception("failed to resync after reconnecting the postgres listener")
+
+    async def resync(self):
+        """
+        Re-reads everything kept in step by notifications, any sent while
+        the listener was disconnected were lost.
+        """
+        await self._genres_changed("")
+        await self.commands.refresh(self.pool)
+        self.aliases.clear()
+        await self.catalog.load(self)
+        await self.meili.load_fallback(self)
+
+    async def _genres_changed(self, _payload: str):
+        await self.genres.refresh(self.pool)
+
+        # Cached rows hold the old genre names.
+        for cache in self.catalog.row_cache.values():
+            cache.clear()
+
     async def create_tables(self):
         await self.pool.execute("""
         Create or replace function random_string(length integer) returns text as
@@ -215,8 +1036,213 @@ class Backend(FastAPI):
             guild_id BIGINT PRIMARY KEY,
             webhook_url TEXT NOT NULL          
         );
+        Create or replace function notify_table_changed() returns trigger as
+        $$
+        begin
+          perform pg_notify(TG_ARGV[0], TG_OP);
+          return null;
+        end;
+        $$ language plpgsql;
+        
+        DO $$
+        begin
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = 'api_genres_changed') then
+            CREATE TRIGGER api_genres_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON api_genres
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_table_changed('api_genres_changed');
+          end if;
+        end;
+        $$;
+        
+        CREATE TABLE IF NOT EXISTS search_sync_outbox (
+            seq BIGSERIAL PRIMARY KEY,
+            index_name TEXT NOT NULL,
+            doc_id TEXT NOT NULL,
+            deleted BOOLEAN NOT NULL DEFAULT false
+        );
+        CREATE TABLE IF NOT EXISTS search_sync_state (
+            index_name TEXT PRIMARY KEY,
+            high_water BIGINT NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS search_sync_jobs (
+            job TEXT PRIMARY KEY,
+            worker TEXT NOT NULL,
+            state TEXT NOT NULL,
+            progress JSONB NOT NULL DEFAULT '{}',
+            started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        
+        Create or replace function search_sync_track() returns trigger as
+        $$
+        begin
+          if TG_OP = 'DELETE' then
+            INSERT INTO search_sync_outbox (index_name, doc_id, deleted) 
+            VALUES (TG_ARGV[0], OLD.id, true);
+            perform pg_notify('catalog_changed', TG_ARGV[0] || ':' || OLD.id);
+            return OLD;
+          end if;
+          INSERT INTO search_sync_outbox (index_name, doc_id) 
+          VALUES (TG_ARGV[0], NEW.id);
+          perform pg_notify('catalog_changed', TG_ARGV[0] || ':' || NEW.id);
+          return NEW;
+        end;
+        $$ language plpgsql;
+        
+        DO $$
+        begin
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = 'api_anime_data_search_sync') then
+            CREATE TRIGGER api_anime_data_search_sync 
+            AFTER INSERT OR UPDATE OR DELETE ON api_anime_data
+            FOR EACH ROW EXECUTE PROCEDURE search_sync_track('anime');
+          end if;
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = 'api_manga_data_search_sync') then
+            CREATE TRIGGER api_manga_data_search_sync 
+            AFTER INSERT OR UPDATE OR DELETE ON api_manga_data
+            FOR EACH ROW EXECUTE PROCEDURE search_sync_track('manga');
+          end if;
+        end;
+        $$;
+        
+        CREATE TABLE IF NOT EXISTS api_collection_versions (
+            name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+        
+        Create or replace function bump_collection_version() returns trigger as
+        $$
+        begin
+          INSERT INTO api_collection_versions (name, version) VALUES (TG_TABLE_NAME, 1)
+          ON CONFLICT (name) DO UPDATE SET version = api_collection_versions.version + 1;
+          return null;
+        end;
+        $$ language plpgsql;
+        
+        DO $$
+        begin
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = 'bot_commands_version') then
+            CREATE TRIGGER bot_commands_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON bot_commands
+            FOR EACH STATEMENT EXECUTE PROCEDURE bump_collection_version();
+          end if;
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = 'bot_commands_changed') then
+            CREATE TRIGGER bot_commands_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON bot_commands
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_table_changed('bot_commands_changed');
+          end if;
+        end;
+        $$;
+        
+        Create or replace function notify_alias_changed() returns trigger as
+        $$
+        begin
+          -- The payload is the owner id, or * when the whole table went.
+          if TG_OP = 'TRUNCATE' then
+            perform pg_notify(TG_ARGV[0], '*');
+            return null;
+          end if;
+          if TG_OP <> 'INSERT' then
+            perform pg_notify(TG_ARGV[0], to_jsonb(OLD) ->> TG_ARGV[1]);
+          end if;
+          if TG_OP <> 'DELETE' then
+            perform pg_notify(TG_ARGV[0], to_jsonb(NEW) ->> TG_ARGV[1]);
+          end if;
+          return null;
+        end;
+        $$ language plpgsql;
+        
+        DO $$
+        begin
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = 'user_command_aliases_changed') then
+            CREATE TRIGGER user_command_aliases_changed
+            AFTER INSERT OR UPDATE OR DELETE ON user_command_aliases
+            FOR EACH ROW EXECUTE PROCEDURE notify_alias_changed('user_command_aliases_changed', 'user_id');
+            CREATE TRIGGER user_command_aliases_truncated
+            AFTER TRUNCATE ON user_command_aliases
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_alias_changed('user_command_aliases_changed', 'user_id');
+          end if;
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = 'guild_command_aliases_changed') then
+            CREATE TRIGGER guild_command_aliases_changed
+            AFTER INSERT OR UPDATE OR DELETE ON guild_command_aliases
+            FOR EACH ROW EXECUTE PROCEDURE notify_alias_changed('guild_command_aliases_changed', 'guild_id');
+            CREATE TRIGGER guild_command_aliases_truncated
+            AFTER TRUNCATE ON guild_command_aliases
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_alias_changed('guild_command_aliases_changed', 'guild_id');
+          end if;
+        end;
+        $$;
         """)
 
+        triggers = "\n".join(f"""
+          if not exists (SELECT 1 FROM pg_trigger WHERE tgname = '{table}_changelog') then
+            CREATE TRIGGER {table}_changelog
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE sync_changelog_track();
+            CREATE TRIGGER {table}_changelog_truncate
+            AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE sync_changelog_track();
+          end if;""" for table in SYNC_CHANGELOG_TABLES)
+
+        await self.pool.execute(f"""
+        CREATE TABLE IF NOT EXISTS sync_changelog (
+            version BIGSERIAL PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL,
+            data JSONB,
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS sync_changelog_changed_at ON sync_changelog (changed_at);
+        
+        Create or replace function sync_changelog_track() returns trigger as
+        $$
+        begin
+          -- Held until commit so versions are handed out in commit order,
+          -- readers can then never skip a version that commits late.
+          perform pg_advisory_xact_lock({SYNC_CHANGELOG_LOCK_ID});
+          if TG_OP = 'TRUNCATE' then
+            INSERT INTO sync_changelog (table_name, op) VALUES (TG_TABLE_NAME, TG_OP);
+          elsif TG_OP = 'DELETE' then
+            INSERT INTO sync_changelog (table_name, op, data) VALUES (TG_TABLE_NAME, TG_OP, to_jsonb(OLD));
+          else
+            INSERT INTO sync_changelog (table_name, op, data) VALUES (TG_TABLE_NAME, TG_OP, to_jsonb(NEW));
+          end if;
+          return null;
+        end;
+        $$ language plpgsql;
+        
+        DO $$
+        begin
+          {triggers}
+        end;
+        $$;
+        """)
+
+    async def prune_changelog(self):
+        """
+        Drops change log entries older than the retention period, the
+        highest dropped version is kept so clients behind it can be told
+        to resync.
+        """
+
+        while True:
+            try:
+                await self.pool.execute("""
+                    WITH pruned AS (
+                        DELETE FROM sync_changelog
+                        WHERE changed_at < now() - make_interval(secs => $1)
+                        RETURNING version
+                    )
+                    INSERT INTO api_collection_versions (name, version)
+                    SELECT 'sync_changelog_pruned', max(version) FROM pruned
+                    HAVING count(*) > 0
+                    ON CONFLICT (name) 
+                    DO UPDATE SET version = greatest(api_collection_versions.version, excluded.version);
+                """, settings.SYNC_CHANGELOG_RETENTION)
+            except Exception:
+                logger.exception("failed to prune the sync change log")
+
+            await asyncio.sleep(settings.SYNC_CHANGELOG_PRUNE_INTERVAL)
+
 
 
 
@@ -0,0 +1,50 @@
+import pytest
+
+from utils.local_search import LocalSearchEngine, edit_distance
+
+TITLES = [
+    {"id": "1", "title": "Naruto", "rating": 8.0},
+    {"id": "2", "title": "Bleach", "rating": 7.9},
+    {"id": "3", "title": "Kaguya-sama: Love is War", "rating": 8.4},
+    {"id": "4", "title": "One Piece", "rating": 8.7},
+]
+
+
+@pytest.fixture
+def engine():
+    engine = LocalSearchEngine({"anime": ["title"]})
+    engine.add_documents("anime", TITLES)
+    engine.ready = True
+    return engine
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("narto", "1"),
+    ("naruot", "1"),
+    ("bleech", "2"),
+    ("kaguay", "3"),
+    ("naru", "1"),
+])
+def test_typos_match(engine, query, expected):
+    hits = engine.search("anime", query)["hits"]
+    assert hits and hits[0]["id"] == expected
+
+
+def test_short_words_need_exact_matches(engine):
+    assert engine.search("anime", "pice")["hits"] == []
+
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("naruto", "naruto", 0),
+    ("narto", "naruto", 1),
+    ("naruot", "naruto", 1),
+    ("bleech", "bleach", 1),
+    ("kaguay", "kaguya", 1),
+    ("kagyau", "kaguya", 2),
+])
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b, 2) == distance
+
+
+def test_edit_distance_is_capped():
+    assert edit_distance("naruto", "bleach", 1) == 2
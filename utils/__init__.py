@@ -1,4 +1,14 @@
 from .list_helpers import chunk_n
+from .cache import TTLCache, ReadThroughCache
+from .circuit import CircuitBreaker
+from .local_search import LocalSearchEngine
+from .write_queue import WriteBehindQueue
+from .autocomplete import PrefixIndex
+from .genres import GenreRegistry
+from .catalog import CatalogSnapshot
+from .batching import BatchLoader
+from .commands import CommandCatalog, CommandSnapshot
+from .aliases import AliasResolver
 
 
 def read_md(file: str):
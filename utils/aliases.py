@@ -0,0 +1,79 @@
+from functools import partial
+from typing import Container, Dict, Optional, Tuple
+
+from .cache import ReadThroughCache
+
+ALIAS_TABLES = {
+    "user": ("user_command_aliases", "user_id"),
+    "guild": ("guild_command_aliases", "guild_id"),
+}
+
+
+class AliasResolver:
+    """
+    Per-user and per-guild alias maps, each owner's aliases are loaded the
+    first time they're needed and kept in an LRU bounded cache.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float):
+        self.maps: Dict[str, ReadThroughCache] = {
+            scope: ReadThroughCache(maxsize, ttl, stale_ttl)
+            for scope in ALIAS_TABLES
+        }
+
+    @staticmethod
+    async def _load(pool, scope: str, owner_id: int) -> Dict[str, str]:
+        table, column = ALIAS_TABLES[scope]
+        rows = await pool.fetch(f"""
+            SELECT alias, command_id FROM {table}
+            WHERE {column} = $1
+            ORDER BY command_id;
+        """, owner_id)
+
+        # An alias can point at several commands, the lowest command id wins.
+        aliases = {}
+        for row in rows:
+            aliases.setdefault(row['alias'], row['command_id'])
+        return aliases
+
+    async def get(self, pool, scope: str, owner_id: int) -> Dict[str, str]:
+        return await self.maps[scope].get(owner_id, partial(self._load, pool, scope))
+
+    async def resolve(
+        self,
+        pool,
+        alias: str,
+        known: Container[str],
+        user_id: Optional[int] = None,
+        guild_id: Optional[int] = None,
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Gets the command id an alias points at and the scope it came from,
+        a user's own aliases take priority over their guild's. Aliases to
+        command ids not in ``known`` are skipped, their command was removed.
+        """
+        for scope, owner_id in (("user", user_id), ("guild", guild_id)):
+            if owner_id is None:
+                continue
+
+            aliases = await self.get(pool, scope, owner_id)
+            command_id = aliases.get(alias)
+            if command_id is not None and command_id in known:
+                return command_id, scope
+
+        return None
+
+    def invalidate(self, scope: str, owner_id: int):
+        self.maps[scope].invalidate(owner_id)
+
+    def clear(self):
+        for cache in self.maps.values():
+            cache.clear()
+
+    async def changed(self, scope: str, payload: str):
+        """ Handles an alias change notification, sent by any worker's write. """
+
+        if payload == "*":
+            self.maps[scope].clear()
+        else:
+            self.invalidate(scope, int(payload))
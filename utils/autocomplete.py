@@ -0,0 +1,104 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+def normalise(value: str) -> str:
+    return " ".join(value.lower().split())
+
+
+class PrefixIndex:
+    """
+    Sorted (key, id) pairs over a set of title fields, a prefix lookup is a
+    bisect into the list followed by a short scan. Every word start in a
+    title is indexed so "tit" finds "Attack on Titan" as well.
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        self._entries: List[Tuple[str, str]] = []
+        self._keys: Dict[str, List[str]] = {}
+        self._titles: Dict[str, dict] = {}
+
+    def __len__(self):
+        return len(self._titles)
+
+    def _index_keys(self, doc: dict) -> List[str]:
+        keys = set()
+        for field in self.fields:
+            value = doc.get(field)
+            if not value:
+                continue
+
+            words = normalise(value).split(" ")
+            for i in range(len(words)):
+                keys.add(" ".join(words[i:]))
+        return list(keys)
+
+    def _store(self, doc_id: str, doc: dict, keys: List[str]):
+        self._keys[doc_id] = keys
+        self._titles[doc_id] = {"id": doc_id, **{field: doc.get(field) for field in self.fields}}
+
+    def add(self, doc: dict):
+        doc_id = str(doc["id"])
+        self.remove(doc_id)
+
+        keys = self._index_keys(doc)
+        for key in keys:
+            insort(self._entries, (key, doc_id))
+        self._store(doc_id, doc, keys)
+
+    def add_many(self, docs: Iterable[dict]):
+        """
+        Adds a batch of documents with one sort over the entries instead of
+        an insort per key, which would make building a large index quadratic.
+        """
+        # Old entries go first, remove bisects so it needs the list sorted.
+        docs = {str(doc["id"]): doc for doc in docs}
+        for doc_id in docs:
+            self.remove(doc_id)
+
+        for doc_id, doc in docs.items():
+            keys = self._index_keys(doc)
+            self._entries.extend((key, doc_id) for key in keys)
+            self._store(doc_id, doc, keys)
+
+        # The existing entries are one sorted run so this is close to a merge.
+        self._entries.sort()
+
+    def remove(self, doc_id: str):
+        for key in self._keys.pop(doc_id, ()):
+            i = bisect_left(self._entries, (key, doc_id))
+            if i < len(self._entries) and self._entries[i] == (key, doc_id):
+                del self._entries[i]
+        self._titles.pop(doc_id, None)
+
+    def complete(self, prefix: str, limit: int) -> List[dict]:
+        prefix = normalise(prefix)
+        if not prefix:
+            return []
+
+        # Whole title matches are ranked ahead of matches on a later word.
+        matches: Dict[str, bool] = {}
+        i = bisect_left(self._entries, (prefix, ""))
+        while i < len(self._entries) and len(matches) < limit * 4:
+            key, doc_id = self._entries[i]
+            if not key.startswith(prefix):
+                break
+
+            whole = self._is_title(doc_id, key)
+            matches[doc_id] = matches.get(doc_id, False) or whole
+            i += 1
+
+        ranked = sorted(matches, key=lambda doc_id: (not matches[doc_id], len(self._title(doc_id))))
+        return [self._titles[doc_id] for doc_id in ranked[:limit]]
+
+    def _title(self, doc_id: str) -> str:
+        titles = self._titles[doc_id]
+        return next((titles[field] for field in self.fields if titles.get(field)), "")
+
+    def _is_title(self, doc_id: str, key: str) -> bool:
+        titles = self._titles[doc_id]
+        return any(
+            titles.get(field) and normalise(titles[field]) == key
+            for field in self.fields
+        )
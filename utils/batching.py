@@ -0,0 +1,99 @@
+import time
+import asyncio
+
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Generic, Hashable, List, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class BatchLoader(Generic[K, V]):
+    """
+    Coalesces single key lookups made around the same time into one call of
+    ``load_many``, a batch is dispatched once ``max_batch`` keys are queued
+    or ``max_wait`` seconds after its first key arrived.
+
+    ``load_many`` returns a mapping of the keys it found, missing keys
+    resolve to None. Concurrent lookups for the same key share one result.
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[List[K]], Awaitable[Dict[K, V]]],
+        *,
+        max_batch: int,
+        max_wait: float,
+    ):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self.batches = 0
+        self.keys_loaded = 0
+        self.requests = 0
+        self._recent: Deque[tuple] = deque(maxlen=256)
+
+        self._load_many = load_many
+        self._pending: Dict[K, asyncio.Future] = {}
+        self._opened_at = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def load(self, key: K) -> Optional[V]:
+        self.requests += 1
+
+        fut = self._pending.get(key)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            if len(self._pending) == 0:
+                self._opened_at = time.perf_counter()
+                self._timer = loop.call_later(self.max_wait, self._dispatch)
+
+            fut = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+
+        return await asyncio.shield(fut)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, {}
+        if len(batch) == 0:
+            return
+
+        waited = time.perf_counter() - self._opened_at
+        self.batches += 1
+        self.keys_loaded += len(batch)
+        self._recent.append((len(batch), waited))
+
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: Dict[K, asyncio.Future]):
+        try:
+            found = await self._load_many(list(batch))
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for key, fut in batch.items():
+            if not fut.done():
+                fut.set_result(found.get(key))
+
+    def stats(self) -> Dict[str, Any]:
+        recent = list(self._recent)
+        sizes = [size for size, _ in recent]
+        waits = [waited for _, waited in recent]
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "keys_loaded": self.keys_loaded,
+            "mean_batch_size": self.keys_loaded / self.batches if self.batches else 0.0,
+            "recent_mean_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "recent_max_batch_size": max(sizes, default=0),
+            "recent_mean_wait_ms": 1000 * sum(waits) / len(waits) if waits else 0.0,
+            "recent_max_wait_ms": 1000 * max(waits, default=0.0),
+        }
@@ -0,0 +1,164 @@
+import time
+import asyncio
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class TTLCache:
+    """
+    A size bound LRU cache where every entry also expires ``ttl`` seconds
+    after it was set, hits and misses are counted for tuning.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class ReadThroughCache:
+    """
+    A size bound LRU cache which loads missing keys itself. Entries are
+    fresh for ``ttl`` seconds and may then be served stale for another
+    ``stale_ttl`` seconds while a single background refresh runs.
+
+    Only one load per key is ever in flight, concurrent misses wait on it.
+    Keys that load as None aren't cached.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: Hashable, load: Callable[[Any], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            fresh_until, stale_until, value = entry
+            now = time.monotonic()
+            if now < fresh_until:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+
+            if now < stale_until:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                if key not in self._inflight:
+                    self._start_load(key, load)
+                return value
+
+            del self._entries[key]
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start_load(key, load)
+        return await asyncio.shield(task)
+
+    def _start_load(self, key: Hashable, load: Callable[[Any], Awaitable[Any]]) -> asyncio.Task:
+        task = self._inflight[key] = asyncio.ensure_future(self._load(key, load))
+        task.add_done_callback(self._loaded)
+        return task
+
+    async def _load(self, key: Hashable, load: Callable[[Any], Awaitable[Any]]) -> Any:
+        try:
+            value = await load(key)
+        except Exception:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+            raise
+
+        # An invalidation while loading drops the task, its result isn't kept.
+        if self._inflight.get(key) is asyncio.current_task():
+            del self._inflight[key]
+            if value is not None:
+                self._set(key, value)
+
+        return value
+
+    def _loaded(self, task: asyncio.Task):
+        # Stale refreshes have nobody awaiting them so collect their errors here.
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+
+    def _set(self, key: Hashable, value: Any):
+        now = time.monotonic()
+        self._entries[key] = (now + self.ttl, now + self.ttl + self.stale_ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refresh_errors": self.refresh_errors,
+        }
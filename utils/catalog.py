@@ -0,0 +1,190 @@
+import numpy as np
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """ Counts the set bits of every element of an int64 array. """
+
+    if hasattr(np, "bitwise_count"):
+        # Viewed as unsigned since bitwise_count counts |x| for signed ints.
+        return np.bitwise_count(values.view(np.uint64))
+
+    # Older numpy has no popcount ufunc so count per byte with a lookup table.
+    per_byte = _POPCOUNT_TABLE[values.view(np.uint8)]
+    return per_byte.reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+
+class CatalogSnapshot:
+    """
+    A columnar copy of a catalog table's browse fields, ratings and genre
+    flags are held in numpy arrays so filters run over the whole catalog
+    at once instead of row by row.
+
+    Rows are upserted in place and deletes only clear the ``alive`` flag,
+    the arrays grow by doubling so single row upserts stay cheap.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.version = 0
+        self._size = 0
+        self._positions: Dict[str, int] = {}
+        self.ids: List[Optional[str]] = []
+        self.titles: List[Optional[str]] = []
+        self.ratings = np.zeros(capacity, dtype=np.float32)
+        self.genres = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _grow(self, capacity: int):
+        for name in ("ratings", "genres", "alive"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def upsert(self, doc_id: str, title: str, rating: float, genres: int):
+        pos = self._positions.get(doc_id)
+        if pos is None:
+            pos = self._size
+            if pos == len(self.ratings):
+                self._grow(max(len(self.ratings) * 2, 1024))
+
+            self._size += 1
+            self._positions[doc_id] = pos
+            self.ids.append(doc_id)
+            self.titles.append(title)
+        else:
+            self.titles[pos] = title
+
+        self.ratings[pos] = rating
+        self.genres[pos] = genres
+        self.alive[pos] = True
+        self.version += 1
+
+    def upsert_many(self, rows: Iterable[dict]):
+        for row in rows:
+            self.upsert(row['id'], row['title'], row['rating'], row['genres'])
+
+    def remove(self, doc_id: str):
+        pos = self._positions.pop(doc_id, None)
+        if pos is None:
+            return
+
+        self.alive[pos] = False
+        self.ids[pos] = None
+        self.titles[pos] = None
+        self.version += 1
+
+    def position(self, doc_id: str) -> Optional[int]:
+        return self._positions.get(doc_id)
+
+    def mask(
+        self,
+        all_of: int = 0,
+        any_of: int = 0,
+        none_of: int = 0,
+        min_rating: Optional[float] = None,
+        max_rating: Optional[float] = None,
+    ) -> np.ndarray:
+        n = self._size
+        genres = self.genres[:n]
+        ratings = self.ratings[:n]
+
+        mask = self.alive[:n].copy()
+        if all_of:
+            mask &= (genres & all_of) == all_of
+        if any_of:
+            mask &= (genres & any_of) != 0
+        if none_of:
+            mask &= (genres & none_of) == 0
+        if min_rating is not None:
+            mask &= ratings >= min_rating
+        if max_rating is not None:
+            mask &= ratings <= max_rating
+        return mask
+
+    def top_k(self, mask: np.ndarray, k: int, scores: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Gets the positions of the ``k`` highest scoring rows in ``mask``,
+        highest first, scores default to each row's rating.
+        """
+        if scores is None:
+            scores = self.ratings[:self._size]
+
+        candidates = np.flatnonzero(mask)
+        if k < len(candidates):
+            # Partition first so only the k winners need a full sort.
+            part = np.argpartition(-scores[candidates], k - 1)[:k]
+            candidates = candidates[part]
+
+        order = np.argsort(-scores[candidates], kind="stable")
+        return candidates[order]
+
+    def browse(
+        self,
+        offset: int,
+        limit: int,
+        **filters,
+    ) -> Tuple[int, List[dict]]:
+        """ Gets a page of the matching rows ordered by rating, and the total. """
+
+        mask = self.mask(**filters)
+        positions = self.top_k(mask, offset + limit)[offset:]
+        return int(mask.sum()), [self.row(pos) for pos in positions]
+
+    def similar(self, doc_id: str, limit: int) -> Optional[List[dict]]:
+        """
+        Ranks rows by the jaccard similarity of their genre flags to the
+        given row's, scaled up by rating, returns None for an unknown id.
+        """
+        pos = self._positions.get(doc_id)
+        if pos is None:
+            return None
+
+        n = self._size
+        genres = self.genres[:n]
+        target = self.genres[pos]
+
+        shared = popcount(genres & target)
+        union = popcount(genres | target)
+        jaccard = np.divide(shared, union, out=np.zeros(n, dtype=np.float64), where=union != 0)
+        scores = jaccard * (1 + self.ratings[:n] / 10)
+
+        mask = self.alive[:n] & (shared > 0)
+        mask[pos] = False
+
+        results = []
+        for hit in self.top_k(mask, limit, scores):
+            row = self.row(hit)
+            row["score"] = round(float(scores[hit]), 4)
+            results.append(row)
+        return results
+
+    def ranked(self, k: int, flags: Iterable[int]) -> Dict[Optional[int], List[dict]]:
+        """
+        Gets the ``k`` highest rated rows overall, keyed by None, and within
+        each of the given genre flags. Rows are sorted once and each genre
+        just filters that order.
+        """
+        n = self._size
+        order = np.flatnonzero(self.alive[:n])
+        order = order[np.argsort(-self.ratings[order], kind="stable")]
+        genres = self.genres[order]
+
+        ranked = {None: [self.row(pos) for pos in order[:k]]}
+        for flag in flags:
+            ranked[flag] = [self.row(pos) for pos in order[(genres & flag) != 0][:k]]
+        return ranked
+
+    def row(self, pos: int) -> dict:
+        return {
+            "id": self.ids[pos],
+            "title": self.titles[pos],
+            "rating": round(float(self.ratings[pos]), 1),
+            "genres": int(self.genres[pos]),
+        }
@@ -0,0 +1,44 @@
+import time
+
+
+class CircuitBreaker:
+    """
+    Trips open after ``failure_threshold`` consecutive failures, while open
+    calls should be short circuited. Once ``reset_timeout`` seconds pass a
+    single trial call is let through, closing the breaker again if it works.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = 0.0
+        self._state = self.CLOSED
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.HALF_OPEN:
+            # Only let one trial call through, the rest wait for its outcome.
+            self._opened_at = time.monotonic()
+            return True
+        return state == self.CLOSED
+
+    def record_success(self):
+        self.failures = 0
+        self._state = self.CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == self.OPEN or self.failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
@@ -0,0 +1,62 @@
+import orjson
+
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+
+class CommandSnapshot:
+    """
+    ``bot_commands`` as of one version of the table, the full list and each
+    category's list are serialized once up front.
+    """
+
+    __slots__ = ("version", "commands", "by_id", "by_name", "body", "categories")
+
+    def __init__(self, version: int, commands: Tuple[dict, ...]):
+        self.version = version
+        self.commands = commands
+        self.by_id: Dict[str, dict] = {command['command_id']: command for command in commands}
+        self.by_name: Dict[str, dict] = {command['name']: command for command in commands}
+        self.body = orjson.dumps({"status": 200, "data": commands})
+
+        by_category = defaultdict(list)
+        for command in commands:
+            by_category[command['category']].append(command)
+
+        self.categories: Dict[str, bytes] = {
+            category: orjson.dumps({"status": 200, "data": listed})
+            for category, listed in by_category.items()
+        }
+
+    @property
+    def etag(self) -> str:
+        return f'"commands-{self.version}"'
+
+
+class CommandCatalog:
+    """
+    Holds the latest ``CommandSnapshot``, a refresh builds a new snapshot
+    and swaps it in so readers never see a half built one.
+    """
+
+    def __init__(self):
+        self.snapshot: Optional[CommandSnapshot] = None
+
+    async def refresh(self, pool):
+        async with pool.acquire() as conn:
+            # Repeatable read so the version matches the rows read after it.
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                version = await conn.fetchval("""
+                    SELECT version FROM api_collection_versions WHERE name = 'bot_commands';
+                """)
+                rows = await conn.fetch("""
+                    SELECT * FROM bot_commands ORDER BY command_id;
+                """)
+
+        version = version or 0
+
+        # Refreshes can finish out of order, never go back to an older table.
+        if self.snapshot is not None and version < self.snapshot.version:
+            return
+
+        self.snapshot = CommandSnapshot(version, tuple(dict(row) for row in rows))
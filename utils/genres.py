@@ -0,0 +1,82 @@
+import hashlib
+
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Flags come from clients too so the decode memo is kept LRU bounded.
+DECODE_CACHE_SIZE = 4096
+
+# Flags are stored as a BIGINT, the sign bit is just another flag.
+FLAG_BITS = (1 << 64) - 1
+
+
+class GenreRegistry:
+    """
+    An in-process copy of ``api_genres``, genre ids are bit flags so a row's
+    ``genres`` column can be decoded without going back to postgres.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.digest = ""
+        self._entries: Tuple[Tuple[int, str], ...] = ()
+        self._by_id: Dict[int, str] = {}
+        self._by_name: Dict[str, int] = {}
+        self._mask = 0
+        self._decoded: "OrderedDict[int, List[str]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, rows: Iterable[dict]):
+        entries = tuple(sorted((row['id'], row['name']) for row in rows))
+
+        # Swap every mapping in at once so readers never see a partial load.
+        self._entries = entries
+        self._by_id = dict(entries)
+        self._by_name = {name: genre_id for genre_id, name in entries}
+        self._mask = reduce(or_, (genre_id & FLAG_BITS for genre_id, _ in entries), 0)
+        self._decoded = OrderedDict()
+        self.version += 1
+
+        # Unlike the version this is the same on every worker, it goes into etags.
+        self.digest = hashlib.blake2b(repr(entries).encode(), digest_size=8).hexdigest()
+
+    async def refresh(self, pool):
+        rows = await pool.fetch("SELECT id, name FROM api_genres;")
+        self.load(rows)
+
+    def get(self, genre_id: int) -> Optional[str]:
+        return self._by_id.get(genre_id)
+
+    def get_by_name(self, name: str) -> Optional[int]:
+        return self._by_name.get(name)
+
+    def ids(self) -> List[int]:
+        return [genre_id for genre_id, _ in self._entries]
+
+    def unknown_flags(self, flags: int) -> int:
+        """ Gets the bits of ``flags`` that don't belong to any genre. """
+        return flags & FLAG_BITS & ~self._mask
+
+    def items(self, flags: int) -> List[Tuple[int, str]]:
+        return [(genre_id, name) for genre_id, name in self._entries if genre_id & flags != 0]
+
+    def decode(self, flags: int) -> List[str]:
+        names = self._decoded.get(flags)
+        if names is None:
+            names = self._decoded[flags] = [name for _, name in self.items(flags)]
+            if len(self._decoded) > DECODE_CACHE_SIZE:
+                self._decoded.popitem(last=False)
+        else:
+            self._decoded.move_to_end(flags)
+        return list(names)
+
+    def decode_many(self, flags: Iterable[int]) -> List[List[str]]:
+        return [self.decode(value) for value in flags]
+
+    def encode(self, names: Iterable[str]) -> int:
+        return reduce(or_, (self._by_name.get(name, 0) for name in names), 0)
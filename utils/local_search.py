@@ -0,0 +1,216 @@
+import re
+import time
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+MAX_EXPANSIONS = 8
+
+# Score given to a typo'd match for each edit it needed.
+TYPO_PENALTY = 0.2
+
+
+def tokenize(value) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        value = " ".join(map(str, value))
+    return _WORD.findall(str(value).lower())
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"^{word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def allowed_typos(word: str) -> int:
+    """ Mirrors meili, one typo from 5 characters and two from 9. """
+
+    if len(word) >= 9:
+        return 2
+    if len(word) >= 5:
+        return 1
+    return 0
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein distance counting an adjacent swap as one edit,
+    anything over ``limit`` is returned as ``limit + 1``.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+
+    return min(previous[-1], limit + 1)
+
+
+class LocalIndex:
+    """
+    A small in-memory word index with typo tolerance, trigrams find the
+    candidate words and edit distance decides which of them match. Fields
+    listed earlier in ``fields`` rank higher in the same way meili ranks
+    its searchable attributes.
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        self.documents: Dict[str, dict] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._doc_words: Dict[str, Set[str]] = {}
+        self._trigrams: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc: dict):
+        doc_id = str(doc["id"])
+        self.remove(doc_id)
+        self.documents[doc_id] = doc
+
+        words = set()
+        for position, field in enumerate(self.fields):
+            weight = len(self.fields) - position
+            for word in tokenize(doc.get(field)):
+                postings = self._postings[word]
+                if len(postings) == 0:
+                    for tri in trigrams(word):
+                        self._trigrams[tri].add(word)
+                if postings.get(doc_id, 0) < weight:
+                    postings[doc_id] = weight
+                words.add(word)
+
+        self._doc_words[doc_id] = words
+
+    def remove(self, doc_id: str):
+        self.documents.pop(doc_id, None)
+        for word in self._doc_words.pop(doc_id, ()):
+            postings = self._postings[word]
+            postings.pop(doc_id, None)
+            if len(postings) == 0:
+                del self._postings[word]
+                for tri in trigrams(word):
+                    self._trigrams[tri].discard(word)
+
+    def _expand(self, word: str) -> List[Tuple[str, float]]:
+        """ Finds the vocabulary words close enough to ``word`` to match it. """
+
+        candidates: Set[str] = set()
+        for tri in trigrams(word):
+            candidates.update(self._trigrams.get(tri, ()))
+
+        typos = allowed_typos(word)
+        matches = []
+        for candidate in candidates:
+            if candidate == word:
+                similarity = 1.0
+            elif candidate.startswith(word):
+                similarity = 0.9
+            else:
+                distance = edit_distance(word, candidate, typos)
+                if distance > typos:
+                    continue
+                similarity = 1.0 - TYPO_PENALTY * distance
+
+            matches.append((candidate, similarity))
+
+        matches.sort(key=lambda m: m[1], reverse=True)
+        return matches[:MAX_EXPANSIONS]
+
+    def search(self, query: str) -> List[dict]:
+        words = tokenize(query)
+        if len(words) == 0:
+            return list(self.documents.values())
+
+        scores: Dict[str, float] = defaultdict(float)
+        for word in words:
+            best: Dict[str, float] = {}
+            for candidate, similarity in self._expand(word):
+                for doc_id, weight in self._postings[candidate].items():
+                    score = similarity * weight
+                    if best.get(doc_id, 0) < score:
+                        best[doc_id] = score
+
+            for doc_id, score in best.items():
+                scores[doc_id] += score
+
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (item[1], self.documents[item[0]].get("rating") or 0),
+            reverse=True,
+        )
+        return [self.documents[doc_id] for doc_id, _ in ranked]
+
+
+class LocalSearchEngine:
+    """
+    An in-process stand in for meili which answers searches with the same
+    result shape, used when meili is unreachable and for tests / benchmarks.
+    """
+
+    def __init__(self, searchable_attributes: Dict[str, Sequence[str]]):
+        self.indexes = {
+            index: LocalIndex(fields) for index, fields in searchable_attributes.items()
+        }
+        self.ready = False
+
+    def add_documents(self, index: str, documents: Iterable[dict]):
+        target = self.indexes[index]
+        for doc in documents:
+            target.add(doc)
+
+    def delete_documents(self, index: str, ids: Iterable[str]):
+        target = self.indexes[index]
+        for doc_id in ids:
+            target.remove(str(doc_id))
+
+    def search(self, index: str, query: str, options: Optional[dict] = None) -> dict:
+        """
+        Searches like ``MeiliEngine.search`` and accepts the same options,
+        including the ``genres``, ``min_rating`` and ``sort`` filters.
+        """
+        options = options or {}
+        offset = options.get("offset", 0)
+        limit = options.get("limit", 20)
+
+        start = time.perf_counter()
+        hits = self.indexes[index].search(query)
+
+        genres = set(options.get("genres") or ())
+        if len(genres) > 0:
+            hits = [hit for hit in hits if genres.issubset(hit.get("genres") or ())]
+
+        min_rating = options.get("min_rating")
+        if min_rating is not None:
+            hits = [hit for hit in hits if (hit.get("rating") or 0) >= min_rating]
+
+        sort = options.get("sort")
+        if sort is not None:
+            field, _, direction = sort.partition(":")
+            hits.sort(key=lambda hit: hit.get(field) or 0, reverse=direction == "desc")
+
+        elapsed = int((time.perf_counter() - start) * 1000)
+
+        return {
+            "hits": hits[offset:offset + limit],
+            "offset": offset,
+            "limit": limit,
+            "query": query,
+            "nbHits": len(hits),
+            "processingTimeMs": elapsed,
+        }
@@ -1,6 +1,8 @@
 from pydantic import BaseModel
-from typing import Any, List
+from typing import Any, Callable, List, Type
+from fastapi import Request, Response
 from fastapi.responses import ORJSONResponse
+from fastapi.routing import APIRoute
 
 
 class StandardResponse(BaseModel):
@@ -11,3 +13,40 @@ class StandardResponse(BaseModel):
         return ORJSONResponse(self.dict(), status_code=self.status)
 
 
+def etag_matches(request: Request, etag: str) -> bool:
+    """ Checks the request's If-None-Match header against the given strong etag. """
+
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+
+    if header.strip() == "*":
+        return True
+
+    # If-None-Match uses the weak comparison so a W/ prefix is ignored.
+    return any(tag.strip().lstrip("W/") == etag for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def cache_control_route(cache_control: str) -> Type[APIRoute]:
+    """
+    Builds a route class which sets ``Cache-Control`` on successful and
+    not modified responses, errors are left uncacheable.
+    """
+
+    class CacheControlRoute(APIRoute):
+        def get_route_handler(self) -> Callable:
+            handler = super().get_route_handler()
+
+            async def route_handler(request: Request) -> Response:
+                response = await handler(request)
+                if response.status_code in (200, 304):
+                    response.headers.setdefault("Cache-Control", cache_control)
+                return response
+
+            return route_handler
+
+    return CacheControlRoute
@@ -19,6 +19,45 @@ REDIRECT_URL = os.getenv("REDIRECT_URI")
 BASE_URL = os.getenv("BASE_URL")
 
 SEARCH_ENGINE_URI: str = os.getenv("SEARCH_ENGINE_URI")
+SEARCH_ENGINE_TIMEOUT: float = float(os.getenv("SEARCH_ENGINE_TIMEOUT", 5.0))
+SEARCH_ENGINE_CONNECT_TIMEOUT: float = float(os.getenv("SEARCH_ENGINE_CONNECT_TIMEOUT", 1.0))
+SEARCH_ENGINE_KEEPALIVE: float = float(os.getenv("SEARCH_ENGINE_KEEPALIVE", 30.0))
+SEARCH_ENGINE_MAX_CONNECTIONS: int = int(os.getenv("SEARCH_ENGINE_MAX_CONNECTIONS", 32))
+SEARCH_ENGINE_MAX_CONCURRENCY: int = int(os.getenv("SEARCH_ENGINE_MAX_CONCURRENCY", 64))
+SEARCH_INDEX_BATCH_SIZE: int = int(os.getenv("SEARCH_INDEX_BATCH_SIZE", 1000))
+SEARCH_INDEX_MAX_IN_FLIGHT: int = int(os.getenv("SEARCH_INDEX_MAX_IN_FLIGHT", 4))
+SEARCH_TASK_POLL_INTERVAL: float = float(os.getenv("SEARCH_TASK_POLL_INTERVAL", 0.25))
+SEARCH_SYNC_INTERVAL: float = float(os.getenv("SEARCH_SYNC_INTERVAL", 300.0))
+SEARCH_CACHE_SIZE: int = int(os.getenv("SEARCH_CACHE_SIZE", 2048))
+SEARCH_CACHE_TTL: float = float(os.getenv("SEARCH_CACHE_TTL", 60.0))
+SEARCH_BREAKER_FAILURES: int = int(os.getenv("SEARCH_BREAKER_FAILURES", 5))
+SEARCH_BREAKER_RESET: float = float(os.getenv("SEARCH_BREAKER_RESET", 30.0))
+SEARCH_WRITE_BATCH_SIZE: int = int(os.getenv("SEARCH_WRITE_BATCH_SIZE", 500))
+SEARCH_WRITE_FLUSH_INTERVAL: float = float(os.getenv("SEARCH_WRITE_FLUSH_INTERVAL", 1.0))
+SEARCH_WRITE_MAX_PENDING: int = int(os.getenv("SEARCH_WRITE_MAX_PENDING", 10000))
+SEARCH_WRITE_MAX_RETRIES: int = int(os.getenv("SEARCH_WRITE_MAX_RETRIES", 5))
+SEARCH_WRITE_DRAIN_TIMEOUT: float = float(os.getenv("SEARCH_WRITE_DRAIN_TIMEOUT", 20.0))
+SEARCH_MULTI_QUERY_TIMEOUT: float = float(os.getenv("SEARCH_MULTI_QUERY_TIMEOUT", 2.0))
 POSTGRES_URI: str = os.getenv("DATABASE_URL")
 
+CATALOG_LOADER_MAX_BATCH: int = int(os.getenv("CATALOG_LOADER_MAX_BATCH", 100))
+CATALOG_LOADER_MAX_WAIT: float = float(os.getenv("CATALOG_LOADER_MAX_WAIT", 0.002))
+BULK_INGEST_MAX_ITEMS: int = int(os.getenv("BULK_INGEST_MAX_ITEMS", 20000))
+
+CATALOG_REFRESH_DELAY: float = float(os.getenv("CATALOG_REFRESH_DELAY", 0.5))
+SIMILAR_CACHE_SIZE: int = int(os.getenv("SIMILAR_CACHE_SIZE", 1024))
+SIMILAR_CACHE_TTL: float = float(os.getenv("SIMILAR_CACHE_TTL", 600.0))
+ROW_CACHE_SIZE: int = int(os.getenv("ROW_CACHE_SIZE", 10_000))
+ROW_CACHE_TTL: float = float(os.getenv("ROW_CACHE_TTL", 60.0))
+ROW_CACHE_STALE_TTL: float = float(os.getenv("ROW_CACHE_STALE_TTL", 300.0))
+CATALOG_EXPORT_BATCH_SIZE: int = int(os.getenv("CATALOG_EXPORT_BATCH_SIZE", 500))
+RANKED_LIST_SIZE: int = int(os.getenv("RANKED_LIST_SIZE", 50))
+RANKED_LIST_REFRESH_INTERVAL: float = float(os.getenv("RANKED_LIST_REFRESH_INTERVAL", 300.0))
+ALIAS_CACHE_SIZE: int = int(os.getenv("ALIAS_CACHE_SIZE", 50_000))
+ALIAS_CACHE_TTL: float = float(os.getenv("ALIAS_CACHE_TTL", 300.0))
+ALIAS_CACHE_STALE_TTL: float = float(os.getenv("ALIAS_CACHE_STALE_TTL", 60.0))
+SHARD_WARMUP_BATCH_SIZE: int = int(os.getenv("SHARD_WARMUP_BATCH_SIZE", 1000))
+SYNC_CHANGELOG_RETENTION: float = float(os.getenv("SYNC_CHANGELOG_RETENTION", 7 * 24 * 3600.0))
+SYNC_CHANGELOG_PRUNE_INTERVAL: float = float(os.getenv("SYNC_CHANGELOG_PRUNE_INTERVAL", 3600.0))
+
 
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
+
+logger = logging.getLogger("crunchy.queue")
+
+
+class WriteBehindQueue:
+    """
+    Buffers writes and hands them to ``flush`` in batches once either
+    ``batch_size`` items are pending or ``flush_interval`` seconds pass.
+
+    Pending items are coalesced by key so only the latest write for a key
+    is flushed, producers are made to wait once ``max_pending`` items are
+    buffered and failed batches are retried with an exponential backoff.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Any]], Awaitable[Any]],
+        *,
+        name: str,
+        batch_size: int,
+        flush_interval: float,
+        max_pending: int,
+        max_retries: int,
+    ):
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self.flushed = 0
+        self.dropped = 0
+
+        self._flush = flush
+        self._pending: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._has_space: Optional[asyncio.Event] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float):
+        """ Flushes everything still pending then stops the flush task. """
+
+        if self._task is None:
+            return
+
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error("%s: gave up draining with %d writes pending", self.name, len(self._pending))
+        self._task = None
+
+    async def put(self, key: Hashable, item: Any):
+        assert self._task is not None, f"{self.name} was not started"
+
+        while key not in self._pending and len(self._pending) >= self.max_pending:
+            self._has_space.clear()
+            self._wakeup.set()
+            await self._has_space.wait()
+
+        self._pending[key] = item
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing or len(self._pending) > 0:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while len(self._pending) > 0:
+                await self._flush_batch()
+
+                if not self._closing and len(self._pending) < self.batch_size:
+                    break
+
+    async def _flush_batch(self):
+        keys = list(islice(self._pending, self.batch_size))
+        batch = [self._pending.pop(key) for key in keys]
+        self._has_space.set()
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.warning(
+                    "%s: flushing %d writes failed (attempt %d): %r",
+                    self.name, len(batch), attempt + 1, e,
+                )
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(0.5 * 2 ** attempt, 30))
+            else:
+                self.flushed += len(batch)
+                return
+
+        self.dropped += len(batch)
+        logger.error("%s: dropping %d writes after %d attempts", self.name, len(batch), self.max_retries + 1)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+        }